@@ -0,0 +1,369 @@
+"""Нагрузочный стенд для webhook-пути бота.
+
+Поднимает в процессе заглушку Bot API (aiohttp), которая записывает вызовы
+и умеет отвечать с задержкой и ошибками 429, запускает приложение из main.py
+и шлёт в WEBHOOK_PATH реалистичный поток обновлений: продажи с альбомами,
+листание каталога, поиск, одобрение заявок админом.
+
+Каждый размер каталога прогоняется в отдельном процессе (чистый RSS):
+
+    python bench.py
+    python bench.py --sizes 100 5000 --updates 3000 --users 100 --latency 0.02 --error-rate 0.01
+    python bench.py --storage sqlite --limits real
+
+Результат — p50/p99 времени обработки обновления, вызовов Bot API на
+обновление, число 429 и RSS процесса после прогона.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+TOKEN = "123456:BENCH-TOKEN"
+ADMIN_ID = 1
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск", "Самара", "Пермь", "Тверь"]
+WORDS = ["комод", "шкаф", "стул", "кресло", "лампа", "зеркало", "буфет", "сервант", "часы", "ваза", "диван"]
+ADJECTIVES = ["дубовый", "резной", "советский", "латунный", "венский", "старинный", "лакированный"]
+QUERIES = WORDS + ADJECTIVES + ["дуб", "стар", "лампа латунная", "венский стул"]
+
+
+# ========================== Заглушка Bot API =====================
+class FakeBotAPI:
+    """Отвечает на методы Bot API правдоподобными объектами и считает вызовы"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter[str] = Counter()
+        self.errors = 0
+        self._message_ids = itertools.count(1_000_000)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **fields,
+        }
+
+    @staticmethod
+    def photo(file_id: str) -> list[dict]:
+        return [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 1280, "height": 960}]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.error_rate and method != "answerCallbackQuery" and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def result(self, method: str, params: dict):
+        chat_id = params.get("chat_id", ADMIN_ID)
+        if method == "getMe":
+            return {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "sendMessage":
+            return self.message(chat_id, text=params.get("text", ""))
+        if method == "sendPhoto":
+            return self.message(chat_id, photo=self.photo(params.get("photo", "photo")), caption=params.get("caption", ""))
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self.message(chat_id, photo=self.photo(str(m.get("media", "photo")))) for m in media]
+        if method in ("editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"):
+            return self.message(chat_id, text=params.get("text", ""))
+        return True
+
+
+# ========================== Генератор обновлений =================
+class Traffic:
+    """Строит обновления Telegram и ждёт окончания их обработки диспетчером"""
+
+    def __init__(self, main, url: str, http: ClientSession):
+        self.main = main
+        self.url = url
+        self.http = http
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._groups = itertools.count(1)
+        self.waiters: dict[int, asyncio.Future] = {}
+        self.latencies: list[float] = []
+        self.kinds: Counter[str] = Counter()
+
+    # --- обновления ---
+    def user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            **fields,
+        }
+
+    async def post(self, kind: str, payload: dict):
+        update_id = next(self._update_ids)
+        done = asyncio.get_running_loop().create_future()
+        self.waiters[update_id] = done
+        self.kinds[kind] += 1
+        async with self.http.post(self.url, json={"update_id": update_id, **payload}) as resp:
+            resp.raise_for_status()
+        await asyncio.wait_for(done, 60)
+
+    async def text(self, user_id: int, text: str):
+        await self.post("message", {"message": self.message(user_id, text=text)})
+
+    async def photo(self, user_id: int, group: str | None = None):
+        photo = FakeBotAPI.photo(f"bench-photo-{random.getrandbits(48):012x}")
+        fields = {"photo": photo}
+        if group:
+            fields["media_group_id"] = group
+        await self.post("photo", {"message": self.message(user_id, **fields)})
+
+    async def callback(self, user_id: int, data: str):
+        gallery = self.message(user_id, photo=FakeBotAPI.photo("bench-gallery"), caption="Лот")
+        gallery["from"] = {"id": 42, "is_bot": True, "first_name": "Bench"}
+        await self.post("callback", {
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self.user(user_id),
+                "chat_instance": str(user_id),
+                "message": gallery,
+                "data": data,
+            },
+        })
+
+    # --- сценарии ---
+    async def browse(self, user_id: int):
+        await self.text(user_id, "📦 Актуальные лоты")
+        total = max(len(self.main.catalog), 1)
+        for _ in range(random.randint(2, 6)):
+            await self.callback(user_id, f"page:{random.randrange(total)}")
+        lots = list(self.main.catalog)
+        if lots:
+            await self.callback(user_id, f"lot:{random.choice(lots).id}")
+
+    async def search(self, user_id: int):
+        await self.callback(user_id, "search_menu")
+        await self.text(user_id, random.choice(QUERIES))
+
+    async def sell(self, user_id: int):
+        await self.text(user_id, "🛒 Продать вещь")
+        group = f"bench-{next(self._groups)}"
+        await asyncio.gather(*(self.photo(user_id, group) for _ in range(random.randint(2, 5))))
+        await self.text(user_id, "✅ Далее")
+        for value in (
+            f"{random.choice(ADJECTIVES)} {random.choice(WORDS)}",
+            str(random.randint(1900, 1990)),
+            "Хорошее",
+            "100×50×40 см",
+            random.choice(CITIES),
+            str(random.randint(5, 500) * 100),
+            "-",
+            "✅ Одобрить",
+        ):
+            await self.text(user_id, value)
+
+    async def approve(self, user_id: int):
+        items = list(self.main.pending)
+        if not items:
+            return await self.browse(user_id)
+        await self.callback(ADMIN_ID, f"approve:{random.choice(items).pending_id}")
+
+    async def run(self, updates: int, users: int):
+        scenarios = [(self.browse, 5), (self.search, 3), (self.sell, 1), (self.approve, 1)]
+        funcs, weights = zip(*scenarios)
+
+        async def session(user_id: int):
+            while sum(self.kinds.values()) < updates:
+                await random.choices(funcs, weights)[0](user_id)
+
+        await asyncio.gather(*(session(10_000 + i) for i in range(users)))
+
+
+def make_probe(traffic: Traffic):
+    """Внешний middleware диспетчера: время обработки обновления целиком"""
+
+    async def probe(handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            traffic.latencies.append(time.perf_counter() - start)
+            done = traffic.waiters.pop(event.update_id, None)
+            if done is not None and not done.done():
+                done.set_result(None)
+
+    return probe
+
+
+# ========================== Прогон ===============================
+def seed_catalog(main, size: int):
+    for lot_id in range(1, size + 1):
+        main.catalog.add(main.Lot(
+            id=lot_id,
+            photos=[f"bench-lot-{lot_id}-{i}" for i in range(random.randint(1, 4))],
+            title=f"{random.choice(ADJECTIVES)} {random.choice(WORDS)}",
+            year=str(random.randint(1900, 1990)),
+            condition="Хорошее",
+            size="100×50×40 см",
+            price=str(random.randint(5, 500) * 100),
+            city=random.choice(CITIES),
+            comment="-",
+            owner_id=10_000 + lot_id % 50,
+        ))
+    main.save_catalog()
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def serve(app: web.Application) -> tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def child(args) -> dict:
+    random.seed(args.seed)
+    api = FakeBotAPI(latency=args.latency, error_rate=args.error_rate)
+    api_runner, api_port = await serve(api.app())
+
+    os.environ.update(
+        BOT_TOKEN=TOKEN,
+        ADMIN_ID=str(ADMIN_ID),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        RENDER_EXTERNAL_URL="http://127.0.0.1",
+        STORAGE_BACKEND=args.storage,
+        FSM_STORAGE="memory",
+    )
+    if args.limits == "off":
+        os.environ.update(SEND_GLOBAL_RATE="1e9", SEND_CHAT_RATE="1e9", SEND_GROUP_RATE="1e9")
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import main
+
+    await main.start_warmup()
+    seed_catalog(main, args.child)
+    await main.catalog.flush()
+    rss_before = rss_mb()
+
+    app = main.create_app()
+    app_runner, app_port = await serve(app)
+    async with ClientSession() as http:
+        traffic = Traffic(main, f"http://127.0.0.1:{app_port}{main.WEBHOOK_PATH}", http)
+        main.dp.update.outer_middleware(make_probe(traffic))
+        api.calls.clear()
+        started = time.perf_counter()
+        await traffic.run(args.updates, args.users)
+        elapsed = time.perf_counter() - started
+
+    total = len(traffic.latencies)
+    result = {
+        "catalog": args.child,
+        "updates": total,
+        "updates_per_s": total / elapsed,
+        "p50_ms": percentile(traffic.latencies, 0.50) * 1000,
+        "p99_ms": percentile(traffic.latencies, 0.99) * 1000,
+        "max_ms": max(traffic.latencies, default=0) * 1000,
+        "calls_per_update": sum(api.calls.values()) / max(total, 1),
+        "calls": dict(api.calls.most_common()),
+        "errors_429": api.errors,
+        "rss_before_mb": rss_before,
+        "rss_mb": rss_mb(),
+        "kinds": dict(traffic.kinds),
+    }
+    await app_runner.cleanup()
+    await api_runner.cleanup()
+    return result
+
+
+def run_size(size: int, args) -> dict:
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "--child", str(size),
+        "--updates", str(args.updates), "--users", str(args.users),
+        "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+        "--storage", args.storage, "--limits", args.limits, "--seed", str(args.seed),
+    ]
+    with tempfile.TemporaryDirectory(prefix="vintagebot-bench-") as workdir:
+        proc = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"Прогон для каталога {size} завершился с ошибкой")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд webhook-пути")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="размеры каталога")
+    parser.add_argument("--updates", type=int, default=1000, help="обновлений на прогон")
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка ответа Bot API, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--limits", choices=["off", "real"], default="off",
+                        help="off — без лимитов SendScheduler, чтобы мерить сам бот")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(asyncio.run(child(args)), ensure_ascii=False))
+        return
+
+    results = [run_size(size, args) for size in args.sizes]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'лотов':>7} {'обновл.':>8} {'обн/с':>8} {'p50 мс':>8} {'p99 мс':>8} "
+          f"{'вызовов/обн':>12} {'429':>5} {'RSS МБ':>8}")
+    for r in results:
+        print(f"{r['catalog']:>7} {r['updates']:>8} {r['updates_per_s']:>8.0f} {r['p50_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f} {r['calls_per_update']:>12.2f} {r['errors_429']:>5} {r['rss_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,44 @@
 import os
 import json
 import logging
+import re
 import asyncio
+import csv
+import hashlib
+import secrets
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from functools import lru_cache, partial
+from itertools import islice
+from operator import attrgetter
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from aiohttp import web
-from aiogram import Bot, Dispatcher, F, types
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
+    FSInputFile,
     InputMediaPhoto,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -30,86 +57,1870 @@ BASE_URL = os.getenv("RENDER_EXTERNAL_URL", "https://vintagebot-97dr.onrender.co
 WEBHOOK_PATH = f"/webhook/{TOKEN}"
 WEBHOOK_URL = f"{BASE_URL}{WEBHOOK_PATH}"
 ADMIN_ID = int(os.getenv("ADMIN_ID", "692408588"))
+# Свой Bot API сервер (локальный telegram-bot-api или заглушка из bench.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 CATALOG_FILE = Path("catalog.json")
 PENDING_FILE = Path("pending.json")
+# Хранилище: "json" (по умолчанию) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+DB_FILE = Path(os.getenv("DB_FILE", "vintage.db"))
+# Счётчики id (для JSON хранилища; в SQLite — таблица sequences)
+SEQUENCES_FILE = Path(os.getenv("SEQUENCES_FILE", "sequences.json"))
+# Сколько id резервируется одной записью счётчика
+ID_BLOCK = int(os.getenv("ID_BLOCK", "10"))
+# Задержка отложенной записи: серия изменений сливается в одну запись на диск
+SAVE_DELAY = float(os.getenv("SAVE_DELAY", "0.5"))
+# Неудачная запись повторяется с удвоением паузы, но не реже чем раз в столько секунд
+SAVE_RETRY_MAX = float(os.getenv("SAVE_RETRY_MAX", "60"))
+# После стольких записей журнала (JSON хранилище) фоном пишется новый снимок
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))
+# Сколько живёт курсор с результатами поиска/фильтра (сек) и сколько их держим
+CURSOR_TTL = int(os.getenv("CURSOR_TTL", "3600"))
+CURSOR_LIMIT = int(os.getenv("CURSOR_LIMIT", "10000"))
+# Лимиты исходящих запросов к Bot API (сообщений в секунду)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "3"))
+# Хранилище состояний форм: "sqlite" (переживает рестарт) или "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_DB_FILE = Path(os.getenv("FSM_DB_FILE", "fsm.db"))
+# Брошенные формы удаляются через FSM_TTL секунд без активности
+FSM_TTL = int(os.getenv("FSM_TTL", str(7 * 24 * 3600)))
+FSM_CACHE_LIMIT = int(os.getenv("FSM_CACHE_LIMIT", "10000"))
+# Режим запуска: webhook (по умолчанию), polling или workers (ingress + N процессов)
+RUN_MODE = os.getenv("RUN_MODE", "webhook").lower()
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 2)))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", str(PORT + 1)))
+# /health отвечает 503, если event loop отстаёт больше чем на столько секунд
+HEALTH_MAX_LAG = float(os.getenv("HEALTH_MAX_LAG", "1.0"))
+# Сколько обновление ждёт первичной загрузки данных, прежде чем ответить «просыпаюсь»
+WARMUP_WAIT = float(os.getenv("WARMUP_WAIT", "15"))
+# Сколько последних update_id помним для отсева повторных доставок
+UPDATE_SEEN_LIMIT = int(os.getenv("UPDATE_SEEN_LIMIT", "10000"))
+# Максимум необработанных обновлений одного чата (лишние отбрасываются)
+CHAT_BACKLOG_LIMIT = int(os.getenv("CHAT_BACKLOG_LIMIT", "100"))
 
-# ========================== Работа с файлами =====================
-def load_json(path: Path) -> list[dict]:
-    """Загружает данные из JSON файла, создает файл если его нет"""
-    if path.exists():
+# ========================== Метрики ==============================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(key: tuple) -> str:
+    if not key:
+        return ""
+    pairs = []
+    for name, value in key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """Счётчики, гистограммы и снимаемые при запросе значения в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._meta: dict[str, tuple[str, str]] = {}
+        self._buckets: dict[str, tuple[float, ...]] = {}
+        self._series: dict[str, dict[tuple, float | list]] = defaultdict(dict)
+        self._collectors: dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text)
+        self._buckets[name] = buckets
+
+    def collect(self, name: str, help_text: str, fn, kind: str = "gauge"):
+        """Значение снимается функцией при каждом запросе /metrics: число или {метки: число}"""
+        self._meta[name] = (kind, help_text)
+        self._collectors[name] = fn
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._series[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self._buckets[name]
+        series = self._series[name]
+        key = tuple(sorted(labels.items()))
+        counts = series.get(key)
+        if counts is None:
+            # Счётчики по корзинам (не накопленные), затем сумма и количество
+            counts = series[key] = [0] * len(buckets) + [0.0, 0]
+        i = bisect_left(buckets, value)
+        if i < len(buckets):
+            counts[i] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
         try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-            logger.info(f"Загружено {len(data)} записей из {path}")
-            return data
-        except Exception as e:
-            logger.exception(f"Ошибка загрузки {path}: {e}")
-            # Если файл поврежден, создаем новый
-            logger.info(f"Создаю новый файл {path} из-за ошибки")
-            save_json(path, [])
-            return []
-    else:
-        logger.info(f"Файл {path} не существует, создаю новый")
-        save_json(path, [])
-    return []
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._collectors:
+                try:
+                    value = self._collectors[name]()
+                except Exception as e:
+                    logger.warning(f"Метрика {name} не снята: {e}")
+                    continue
+                values = value if isinstance(value, dict) else {(): value}
+                lines += [f"{name}{_label_text(key)} {v}" for key, v in values.items()]
+            elif kind == "histogram":
+                for key, counts in list(self._series[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(self._buckets[name], counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_label_text(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_label_text(key + (('le', '+Inf'),))} {counts[-1]}")
+                    lines.append(f"{name}_sum{_label_text(key)} {counts[-2]}")
+                    lines.append(f"{name}_count{_label_text(key)} {counts[-1]}")
+            else:
+                lines += [f"{name}{_label_text(key)} {v}" for key, v in list(self._series[name].items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.counter("vintagebot_updates_total", "Входящие обновления по типу и префиксу callback")
+metrics.histogram("vintagebot_update_seconds", "Время обработки обновления целиком")
+metrics.histogram("vintagebot_handler_seconds", "Время работы обработчика")
+metrics.counter("vintagebot_handler_errors_total", "Исключения в обработчиках")
+metrics.histogram("vintagebot_storage_seconds", "Чтение и запись хранилища")
+metrics.counter("vintagebot_storage_errors_total", "Неудачные записи в хранилище")
+metrics.counter("vintagebot_api_calls_total", "Вызовы Bot API по методу и результату")
+metrics.histogram("vintagebot_api_seconds", "Время вызова Bot API")
+
+# ========================== Работа с файлами =====================
+def load_json(path: Path):
+    """Читает JSON файл; None — если файла нет или он повреждён (тогда он откладывается в сторону)"""
+    if not path.exists():
+        logger.info(f"Файл {path} не существует")
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.exception(f"Ошибка загрузки {path}: {e}")
+        set_aside(path)
+        return None
+
+def set_aside(path: Path):
+    """Повреждённый файл не затираем, а откладываем в сторону для разбора"""
+    broken = path.with_name(f"{path.name}.corrupt-{int(time.time())}")
+    path.replace(broken)
+    logger.error(f"Файл {path} повреждён, сохранён как {broken}")
 
-def save_json(path: Path, data: list[dict]):
-    """Сохраняет данные в JSON файл"""
+def save_json(path: Path, data: list[dict]) -> bool:
+    """Атомарно сохраняет данные: пишет во временный файл и подменяет им исходный"""
+    tmp = path.with_name(f".{path.name}.tmp")
     try:
-        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
         logger.info(f"Сохранено {len(data)} записей в {path}")
+        return True
     except Exception as e:
         logger.exception(f"Ошибка сохранения {path}: {e}")
+        tmp.unlink(missing_ok=True)
+        return False
 
-# Инициализация файлов при импорте модуля
 def init_json_files():
     """Инициализирует JSON файлы, создает их если не существуют"""
+    if STORAGE_BACKEND == "sqlite":
+        return
     logger.info("Проверка и инициализация JSON файлов...")
     
     # Проверяем и создаем catalog.json
     if not CATALOG_FILE.exists():
         logger.info(f"Создаю файл {CATALOG_FILE}")
-        save_json(CATALOG_FILE, [])
+        save_records(CATALOG_FILE, [])
     else:
         logger.info(f"Файл {CATALOG_FILE} существует")
     
     # Проверяем и создаем pending.json
     if not PENDING_FILE.exists():
         logger.info(f"Создаю файл {PENDING_FILE}")
-        save_json(PENDING_FILE, [])
+        save_records(PENDING_FILE, [])
     else:
         logger.info(f"Файл {PENDING_FILE} существует")
 
-# Инициализируем файлы при загрузке модуля
-init_json_files()
+# ========================== Хранилище ===========================
+def parse_price(text) -> int | None:
+    """Числовое значение цены из свободного текста («5 000 ₽» -> 5000)"""
+    digits = "".join(filter(str.isdigit, str(text)))
+    return int(digits) if digits else None
+
+def parse_year(text) -> int | None:
+    """Год выпуска из свободного текста: «1985», «1980-е», «80-х», «~40 лет»"""
+    text = str(text or "").lower()
+    this_year = date.today().year
+    match = re.search(r"\b(1[89]\d\d|20\d\d)\b", text)
+    if match:
+        year = int(match.group(1))
+        return year if year <= this_year else None
+    match = re.search(r"\b(\d0)\s*-?\s*(?:е|х|ые|ых)\b", text)
+    if match:
+        decade = int(match.group(1))
+        return 2000 + decade if 2000 + decade <= this_year else 1900 + decade
+    match = re.search(r"(\d{1,3})\s*(?:лет|год)", text)
+    if match:
+        return this_year - int(match.group(1))
+    return None
+
+# ========================== Модель данных ========================
+class RecordError(ValueError):
+    """Запись из хранилища не соответствует схеме"""
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise RecordError(f"ожидалась строка, получено {type(value).__name__}")
+
+def _title(value) -> str:
+    value = _text(value)
+    if not value.strip():
+        raise RecordError("пустое значение")
+    return value
+
+def _int(value) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise RecordError(f"ожидалось целое число, получено {value!r}")
+
+def _optional_int(value) -> int | None:
+    return None if value is None else _int(value)
+
+def _photos(value) -> list[str]:
+    if not isinstance(value, list) or not value or not all(isinstance(p, str) and p for p in value):
+        raise RecordError("нужен непустой список file_id")
+    return value
+
+
+class Record:
+    """Лот или заявка: поля в __slots__ вместо dict.
+
+    Экземпляр без __dict__ заметно компактнее словаря, а чтение атрибута
+    дешевле поиска по строковому ключу. Записи из хранилища проходят через
+    decode(): битая запись даёт RecordError и уходит в карантин, а не
+    роняет обработчик на KeyError. Неизвестные поля не теряются — они
+    лежат в extra и записываются обратно как есть.
+    """
+
+    __slots__ = (
+        "photos", "title", "year", "condition", "size", "city", "price", "comment",
+        "owner_id", "price_value", "year_value", "extra",
+    )
+
+    # Имя поля-идентификатора и схема: поле -> проверка с приведением типа
+    KEY = ""
+    SCHEMA: dict = {
+        "photos": _photos,
+        "title": _title,
+        "year": _text,
+        "condition": _text,
+        "size": _text,
+        "city": _text,
+        "price": _text,
+        "comment": _text,
+        "owner_id": _optional_int,
+        "price_value": _optional_int,
+        "year_value": _optional_int,
+    }
+
+    def __init__(self, **fields):
+        unknown = fields.keys() - self.SCHEMA.keys()
+        if unknown:
+            raise TypeError(f"{type(self).__name__}: неизвестные поля {sorted(unknown)}")
+        for name in self.SCHEMA:
+            setattr(self, name, fields.get(name))
+        self.extra = None
+        self._fill_numeric()
+
+    def _fill_numeric(self):
+        # Числовые цена и год для фильтров и сортировки, если их не сохранили
+        if self.price_value is None:
+            self.price_value = parse_price(self.price)
+        if self.year_value is None:
+            self.year_value = parse_year(self.year)
+
+    @classmethod
+    def decode(cls, raw):
+        """Проверяет сырую запись из хранилища и собирает из неё объект"""
+        if not isinstance(raw, dict):
+            raise RecordError(f"ожидался объект, получено {type(raw).__name__}")
+        record = cls.__new__(cls)
+        for name, check in cls.SCHEMA.items():
+            try:
+                setattr(record, name, check(raw.get(name)))
+            except RecordError as e:
+                raise RecordError(f"{name}: {e}") from None
+        record._fill_numeric()
+        extra = raw.keys() - cls.SCHEMA.keys()
+        record.extra = {k: raw[k] for k in extra} if extra else None
+        return record
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.SCHEMA}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def fingerprint(self) -> str:
+        """Хэш содержимого: одинаков в любом процессе и после перезагрузки"""
+        raw = json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.KEY}={self.key}, title={self.title!r})"
+
+
+class Lot(Record):
+    """Опубликованный лот каталога"""
+
+    __slots__ = ("id",)
+    KEY = "id"
+    SCHEMA = {"id": _int, **Record.SCHEMA}
+
+    @property
+    def key(self) -> int:
+        return self.id
+
+
+class PendingItem(Record):
+    """Заявка, ожидающая модерации"""
+
+    __slots__ = ("pending_id", "owner_username")
+    KEY = "pending_id"
+    SCHEMA = {"pending_id": _int, "owner_username": _text, **Record.SCHEMA}
+
+    @property
+    def key(self) -> int:
+        return self.pending_id
+
+
+def decode_records(model: type[Record], raws) -> tuple[list[Record], list[tuple[object, str]]]:
+    """Разбирает сырые записи; битые и повторы id возвращаются отдельно с причиной"""
+    records, bad, seen = [], [], set()
+    for raw in raws:
+        try:
+            record = model.decode(raw)
+            if record.key in seen:
+                raise RecordError(f"повторный {model.KEY} {record.key}")
+        except RecordError as e:
+            bad.append((raw, str(e)))
+            continue
+        seen.add(record.key)
+        records.append(record)
+    if bad:
+        logger.warning(f"{model.__name__}: {len(bad)} записей не прошли проверку и отложены в карантин")
+    return records, bad
+
+
+# Версия формата JSON файлов с записями и миграции: RECORDS_MIGRATIONS[n] переводит n -> n + 1
+RECORDS_FORMAT = 2
+
+def _records_v1(raws: list, model: type[Record], fresh_ids=None) -> list:
+    """1 -> 2: голый список записей; добавляются числовые цена и год.
+
+    Старый бот выдавал id как len(...) + 1, поэтому в файле бывают разные
+    записи с одним id. Повторам выдаются новые id из счётчика (fresh_ids),
+    а не карантин: это настоящие заявки и лоты.
+    """
+    seen, repeats = set(), []
+    for raw in raws:
+        if isinstance(raw, dict):
+            raw.setdefault("price_value", parse_price(raw.get("price")))
+            raw.setdefault("year_value", parse_year(raw.get("year")))
+            key = raw.get(model.KEY)
+            if key in seen:
+                repeats.append(raw)
+            seen.add(key)
+    if repeats and fresh_ids is not None:
+        floor = max((key for key in seen if isinstance(key, int)), default=0)
+        for raw, new_id in zip(repeats, fresh_ids(len(repeats), floor)):
+            logger.warning(f"{model.__name__}: повторный {model.KEY} {raw[model.KEY]} заменён на {new_id}")
+            raw[model.KEY] = new_id
+    return raws
+
+RECORDS_MIGRATIONS = {1: _records_v1}
+
+def load_records(path: Path, model: type[Record], fresh_ids=None) -> tuple[list[Record], int]:
+    """Читает снимок записей и номер последней вошедшей в него записи журнала.
+
+    Формат мигрируется, битые записи откладываются в карантин. fresh_ids(count,
+    floor) выдаёт новые id для повторов при миграции старого формата.
+    """
+    data = load_json(path)
+    if data is None:
+        return [], 0
+    if isinstance(data, list):
+        version, raws = 1, data
+    elif isinstance(data, dict) and isinstance(data.get("records"), list):
+        version, raws = data.get("format", 1), data["records"]
+    else:
+        set_aside(path)
+        return [], 0
+    if version > RECORDS_FORMAT:
+        # Файл записан более новой версией бота — не трогаем, чтобы не затереть
+        raise RuntimeError(f"{path}: формат {version} новее поддерживаемого {RECORDS_FORMAT}")
+    for number in range(version, RECORDS_FORMAT):
+        raws = RECORDS_MIGRATIONS[number](raws, model, fresh_ids)
+    seq = data.get("seq", 0) if isinstance(data, dict) else 0
+    records, bad = decode_records(model, raws)
+    logger.info(f"Загружено {len(records)} записей из {path}")
+    if bad:
+        quarantine_json(path, bad)
+    if bad or version < RECORDS_FORMAT:
+        save_records(path, records, seq)
+    return records, seq
+
+def save_records(path: Path, records, seq: int = 0) -> bool:
+    return save_json(path, {
+        "format": RECORDS_FORMAT,
+        "seq": seq,
+        "records": [record.to_dict() for record in records],
+    })
+
+def quarantine_json(path: Path, bad: list[tuple[object, str]]):
+    """Дописывает битые записи в <файл>.quarantine.jsonl — для ручного разбора"""
+    target = path.with_name(f"{path.name}.quarantine.jsonl")
+    now = int(time.time())
+    with open(target, "a", encoding="utf-8") as f:
+        for raw, error in bad:
+            f.write(json.dumps({"at": now, "error": error, "record": raw}, ensure_ascii=False) + "\n")
+    logger.error(f"{len(bad)} битых записей из {path} перенесены в {target}")
+
+
+class JournalBackend:
+    """JSON: снимок всех записей плюс журнал изменений только на дозапись.
+
+    Сброс изменений — одна строка в <имя>.journal.jsonl с fsync, а не
+    перезапись всего файла, так что стоимость записи зависит от числа
+    изменений, а не от размера каталога. При загрузке к снимку
+    применяются записи журнала новее его seq; оборванный хвост (сбой
+    посреди записи) отрезается. Когда журнал набирает compact_every
+    записей, фоновое сжатие пишет новый снимок и начинает журнал заново.
+
+    Каждая операция журнала помечена событием (submitted, approved,
+    rejected, sold, deleted), поэтому журнал — заодно история модерации.
+    """
+
+    indexed = False
+
+    def __init__(self, path: Path, model: type[Record], compact_every: int = JOURNAL_COMPACT_EVERY, fresh_ids=None):
+        self.path = path
+        self.journal = path.with_name(f"{path.stem}.journal.jsonl")
+        self.model = model
+        self.compact_every = compact_every
+        # Новые id для повторов при миграции старого файла (см. reserve_ids)
+        self.fresh_ids = fresh_ids
+        # Номер последней записи журнала и число записей после снимка
+        self.seq = 0
+        self.entries = 0
+        # Подпись до и после последней собственной записи
+        self.last_write: tuple = (None, None)
+        self._file = None
+
+    def signature(self) -> tuple:
+        signature = []
+        for path in (self.path, self.journal):
+            try:
+                st = path.stat()
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self) -> list[Record]:
+        records, self.seq = load_records(self.path, self.model, self.fresh_ids)
+        by_id = {record.key: record for record in records}
+        self._close()
+        self.entries = 0
+        bad = []
+        for entry in self._read_journal():
+            if entry["seq"] <= self.seq:
+                # Уже вошло в снимок: сжатие прервалось до очистки журнала
+                continue
+            for op in entry["ops"]:
+                if "del" in op:
+                    by_id.pop(op["del"], None)
+                    continue
+                try:
+                    record = self.model.decode(op["put"])
+                except RecordError as e:
+                    bad.append((op["put"], str(e)))
+                    continue
+                by_id[record.key] = record
+            self.seq = entry["seq"]
+            self.entries += 1
+        if bad:
+            quarantine_json(self.path, bad)
+        if self.entries:
+            logger.info(f"Из журнала {self.journal} применено записей: {self.entries}")
+        return list(by_id.values())
+
+    def _read_journal(self) -> list[dict]:
+        try:
+            data = self.journal.read_bytes()
+        except FileNotFoundError:
+            return []
+        entries, offset = [], 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("строка оборвана")
+                entry = json.loads(line)
+                if not isinstance(entry.get("seq"), int) or not isinstance(entry.get("ops"), list):
+                    raise ValueError("нет seq или ops")
+            except ValueError as e:
+                # Всё после повреждения откладываем в сторону и отрезаем
+                broken = self.journal.with_name(f"{self.journal.name}.corrupt-{int(time.time())}")
+                broken.write_bytes(data[offset:])
+                with open(self.journal, "r+b") as f:
+                    f.truncate(offset)
+                logger.error(f"Журнал {self.journal} повреждён с байта {offset} ({e}), хвост сохранён в {broken}")
+                break
+            entries.append(entry)
+            offset += len(line)
+        return entries
+
+    def write_sync(self, items: list[Record], changed: dict[int, Record], removed: set, events: dict[int, str]) -> bool:
+        before = self.signature()
+        if not changed and not removed:
+            self.last_write = (before, before)
+            return True
+        ops = [{"event": events.get(item_id, "removed"), "del": item_id} for item_id in removed]
+        ops += [{"event": events.get(item_id, "updated"), "put": item.to_dict()} for item_id, item in changed.items()]
+        line = json.dumps({"seq": self.seq + 1, "at": int(time.time()), "ops": ops}, ensure_ascii=False) + "\n"
+        offset = None
+        try:
+            if self._file is None:
+                self._file = open(self.journal, "ab")
+            offset = self._file.tell()
+            self._file.write(line.encode("utf-8"))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            logger.exception(f"Ошибка записи в журнал {self.journal}: {e}")
+            # Недописанная строка склеилась бы со следующей
+            if offset is not None:
+                try:
+                    self._file.truncate(offset)
+                except OSError:
+                    pass
+            self._close()
+            return False
+        self.seq += 1
+        self.entries += 1
+        self.last_write = (before, self.signature())
+        return True
+
+    def needs_compaction(self) -> bool:
+        return self.entries >= self.compact_every
+
+    def compact(self, items: list[Record]) -> bool:
+        """Новый снимок на текущий seq, журнал начинается заново"""
+        before = self.signature()
+        if not save_records(self.path, items, self.seq):
+            return False
+        self._close()
+        # Сбой до очистки не страшен: записи с seq <= снимка при загрузке пропускаются
+        open(self.journal, "wb").close()
+        logger.info(f"Журнал {self.journal} сжат: {self.entries} записей -> снимок {self.path} ({len(items)})")
+        self.entries = 0
+        self.last_write = (before, self.signature())
+        return True
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def run(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+
+class SqliteDatabase:
+    """Подключение к SQLite (WAL), все запросы идут через один поток-исполнитель"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS lots (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            year TEXT,
+            condition TEXT,
+            size TEXT,
+            city TEXT,
+            price TEXT,
+            price_value INTEGER,
+            comment TEXT,
+            owner_id INTEGER,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS lots_city ON lots(city);
+        CREATE INDEX IF NOT EXISTS lots_price_value ON lots(price_value);
+
+        CREATE TABLE IF NOT EXISTS pending (
+            pending_id INTEGER PRIMARY KEY,
+            owner_id INTEGER,
+            owner_username TEXT,
+            title TEXT NOT NULL,
+            year TEXT,
+            condition TEXT,
+            size TEXT,
+            city TEXT,
+            price TEXT,
+            price_value INTEGER,
+            comment TEXT,
+            extra TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS photos (
+            kind TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (kind, record_id, position)
+        );
+    """
+
+    # Миграции схемы, номер применённой хранится в PRAGMA user_version
+    MIGRATIONS = (
+        # 1: числовой год для фильтра по году
+        """
+        ALTER TABLE lots ADD COLUMN year_value INTEGER;
+        ALTER TABLE pending ADD COLUMN year_value INTEGER;
+        CREATE INDEX IF NOT EXISTS lots_year_value ON lots(year_value);
+        """,
+        # 2: счётчики id
+        """
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        """,
+        # 3: карантин для записей, не прошедших проверку схемы; числовые поля старых строк
+        """
+        CREATE TABLE IF NOT EXISTS quarantine (
+            kind TEXT NOT NULL,
+            record_id INTEGER,
+            data TEXT NOT NULL,
+            error TEXT NOT NULL,
+            at INTEGER NOT NULL
+        );
+        UPDATE lots SET price_value = parse_price(price) WHERE price_value IS NULL;
+        UPDATE lots SET year_value = parse_year(year) WHERE year_value IS NULL;
+        UPDATE pending SET price_value = parse_price(price) WHERE price_value IS NULL;
+        UPDATE pending SET year_value = parse_year(year) WHERE year_value IS NULL;
+        """,
+        # 4: история изменений (submitted, approved, rejected, sold, deleted)
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            at INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            event TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_record ON events(kind, record_id);
+        """,
+        # 5: счётчики изменений по таблицам — refresh сравнивает только свою таблицу
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO table_versions (name, version) VALUES ('lots', 0), ('pending', 0);
+        CREATE TRIGGER IF NOT EXISTS lots_insert_version AFTER INSERT ON lots
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'lots'; END;
+        CREATE TRIGGER IF NOT EXISTS lots_update_version AFTER UPDATE ON lots
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'lots'; END;
+        CREATE TRIGGER IF NOT EXISTS lots_delete_version AFTER DELETE ON lots
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'lots'; END;
+        CREATE TRIGGER IF NOT EXISTS pending_insert_version AFTER INSERT ON pending
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'pending'; END;
+        CREATE TRIGGER IF NOT EXISTS pending_update_version AFTER UPDATE ON pending
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'pending'; END;
+        CREATE TRIGGER IF NOT EXISTS pending_delete_version AFTER DELETE ON pending
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'pending'; END;
+        CREATE TRIGGER IF NOT EXISTS photos_insert_version AFTER INSERT ON photos
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = NEW.kind; END;
+        CREATE TRIGGER IF NOT EXISTS photos_update_version AFTER UPDATE ON photos
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name IN (OLD.kind, NEW.kind); END;
+        CREATE TRIGGER IF NOT EXISTS photos_delete_version AFTER DELETE ON photos
+            BEGIN UPDATE table_versions SET version = version + 1 WHERE name = OLD.kind; END;
+        """,
+    )
+
+    def __init__(self, path: Path, schema: str | None = None, migrations: tuple[str, ...] | None = None):
+        self.path = path
+        self.schema = self.SCHEMA if schema is None else schema
+        self.migrations = self.MIGRATIONS if migrations is None else migrations
+        self.conn: sqlite3.Connection | None = None
+        self._watch: sqlite3.Connection | None = None
+        # Счётчики таблиц, прочитанные при последнем значении data_version
+        self._seen_data_version = None
+        self._table_versions: dict[str, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Для миграций, которые пересчитывают числовые поля
+        conn.create_function("parse_price", 1, parse_price)
+        conn.create_function("parse_year", 1, parse_year)
+        conn.executescript(self.schema)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(self.migrations[version:], start=version + 1):
+            conn.executescript(script)
+            conn.execute(f"PRAGMA user_version = {number}")
+            logger.info(f"SQLite: применена миграция схемы №{number}")
+        self.conn = conn
+
+    def open(self):
+        if self.conn is None:
+            self.call(self._connect)
+            logger.info(f"SQLite база открыта: {self.path}")
+
+    async def open_async(self):
+        if self.conn is None:
+            await self.run(self._connect)
+            logger.info(f"SQLite база открыта: {self.path}")
+
+    def call(self, fn, *args):
+        """Синхронно выполняет fn в потоке базы (для старта и утилит)"""
+        return self._executor.submit(fn, *args).result()
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def write_batch(self, writes: list[tuple]) -> bool:
+        """Записывает изменения нескольких таблиц одной транзакцией"""
+        try:
+            with self.conn:
+                # Сразу берём блокировку записи: счётчики таблиц, прочитанные
+                # в начале транзакции, не разойдутся с чужими коммитами
+                self.conn.execute("BEGIN IMMEDIATE")
+                for backend, *changes in writes:
+                    backend.write_rows(*changes)
+            return True
+        except Exception as e:
+            logger.exception(f"Ошибка записи в SQLite: {e}")
+            return False
+
+    def read_sequence(self, name: str) -> int | None:
+        row = self.conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def write_sequence(self, name: str, value: int):
+        """Поднимает счётчик до value (никогда не опускает)"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO sequences (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (name, value),
+            )
+
+    def reserve_sequence(self, name: str, size: int, floor: int) -> int:
+        """Атомарно (в т.ч. между процессами) сдвигает счётчик на size, возвращает новую границу"""
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES (?, ?)", (name, floor))
+            self.conn.execute("UPDATE sequences SET value = value + ? WHERE name = ?", (size, name))
+            return self.conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()[0]
+
+    def data_version(self) -> int:
+        """Меняется, когда базу изменило другое подключение (в т.ч. наш писатель)"""
+        if self._watch is None:
+            self._watch = sqlite3.connect(self.path, check_same_thread=False)
+        return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def table_version(self, table: str) -> int:
+        """Счётчик изменений строк таблицы (триггеры, любое подключение и процесс).
+
+        data_version меняется от любой записи в базу — заявок, счётчиков id,
+        истории, — поэтому он лишь подсказывает, когда перечитать счётчики.
+        """
+        data_version = self.data_version()
+        if data_version != self._seen_data_version:
+            self._table_versions = dict(self._watch.execute("SELECT name, version FROM table_versions"))
+            self._seen_data_version = data_version
+        return self._table_versions.get(table, 0)
+
+    def close(self):
+        if self.conn is not None:
+            self.call(self.conn.close)
+            self.conn = None
+        if self._watch is not None:
+            self._watch.close()
+            self._watch = None
+
+
+class SqliteBackend:
+    """Хранение записей в таблице SQLite, фото — в общей таблице photos"""
+
+    indexed = True
+    NUMERIC_FIELDS = ("price_value", "year_value")
+
+    def __init__(self, db: SqliteDatabase, table: str, model: type[Record], columns: tuple[str, ...]):
+        self.db = db
+        self.table = table
+        self.model = model
+        self.key = model.KEY
+        self.columns = columns
+        # Счётчик изменений таблицы до и после последней собственной записи
+        self.last_write: tuple = (None, None)
+
+    def signature(self) -> int:
+        self.db.open()
+        return self.db.table_version(self.table)
+
+    def load(self) -> list[Record]:
+        self.db.open()
+        items = self.db.call(self._load)
+        logger.info(f"Загружено {len(items)} записей из таблицы {self.table}")
+        return items
+
+    def _load(self) -> list[Record]:
+        conn = self.db.conn
+        photos: dict[int, list[str]] = {}
+        for row in conn.execute(
+            "SELECT record_id, file_id FROM photos WHERE kind = ? ORDER BY record_id, position",
+            (self.table,),
+        ):
+            photos.setdefault(row["record_id"], []).append(row["file_id"])
+        raws = []
+        for row in conn.execute(f"SELECT * FROM {self.table} ORDER BY {self.key}"):
+            raw = {self.key: row[self.key], "photos": photos.get(row[self.key], [])}
+            for col in (*self.columns, *self.NUMERIC_FIELDS):
+                raw[col] = row[col]
+            if row["extra"]:
+                raw.update(json.loads(row["extra"]))
+            raws.append(raw)
+        items, bad = decode_records(self.model, raws)
+        if bad:
+            self._quarantine(bad)
+        return items
+
+    def _quarantine(self, bad: list[tuple[dict, str]]):
+        """Переносит битые строки в таблицу quarantine, чтобы они не читались снова"""
+        now = int(time.time())
+        with self.db.conn as conn:
+            for raw, error in bad:
+                record_id = raw[self.key]
+                conn.execute(
+                    "INSERT INTO quarantine (kind, record_id, data, error, at) VALUES (?, ?, ?, ?, ?)",
+                    (self.table, record_id, json.dumps(raw, ensure_ascii=False, default=str), error, now),
+                )
+                conn.execute(f"DELETE FROM {self.table} WHERE {self.key} = ?", (record_id,))
+                conn.execute("DELETE FROM photos WHERE kind = ? AND record_id = ?", (self.table, record_id))
+        logger.error(f"SQLite {self.table}: {len(bad)} битых записей перенесены в quarantine")
+
+    def _row(self, item: Record) -> tuple:
+        return (
+            item.key,
+            *(getattr(item, col) for col in (*self.columns, *self.NUMERIC_FIELDS)),
+            json.dumps(item.extra, ensure_ascii=False) if item.extra else None,
+        )
+
+    def write_sync(self, items: list[Record], changed: dict[int, Record], removed: set, events: dict[int, str]) -> bool:
+        return self.db.write_batch([(self, items, changed, removed, events)])
+
+    def write_rows(self, items: list[Record], changed: dict[int, Record], removed: set, events: dict[int, str]):
+        """Изменённые и удалённые строки и их события; транзакцию открывает вызывающий"""
+        conn = self.db.conn
+        before = self._version(conn)
+        cols = ", ".join((self.key, *self.columns, *self.NUMERIC_FIELDS, "extra"))
+        marks = ", ".join("?" * (len(self.columns) + len(self.NUMERIC_FIELDS) + 2))
+        for item_id in removed | changed.keys():
+            conn.execute(f"DELETE FROM {self.table} WHERE {self.key} = ?", (item_id,))
+            conn.execute("DELETE FROM photos WHERE kind = ? AND record_id = ?", (self.table, item_id))
+        for item_id, item in changed.items():
+            conn.execute(f"INSERT INTO {self.table} ({cols}) VALUES ({marks})", self._row(item))
+            conn.executemany(
+                "INSERT INTO photos (kind, record_id, position, file_id) VALUES (?, ?, ?, ?)",
+                [(self.table, item_id, i, p) for i, p in enumerate(item.photos)],
+            )
+        now = int(time.time())
+        conn.executemany(
+            "INSERT INTO events (at, kind, record_id, event) VALUES (?, ?, ?, ?)",
+            [(now, self.table, item_id, events.get(item_id, "removed")) for item_id in removed]
+            + [(now, self.table, item_id, events.get(item_id, "updated")) for item_id in changed],
+        )
+        self.last_write = (before, self._version(conn))
+        logger.info(f"SQLite {self.table}: записано {len(changed)}, удалено {len(removed)}")
+
+    def _version(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (self.table,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def needs_compaction(self) -> bool:
+        # Таблицы и так меняются построчно, сжимать нечего
+        return False
+
+    def find_ids(self, city: str | None, ranges: dict[str, tuple[int | None, int | None]]) -> list[int]:
+        where, args = [], []
+        if city is not None:
+            where.append("city = ?")
+            args.append(city)
+        for field, (low, high) in ranges.items():
+            if low is not None:
+                where.append(f"{field} >= ?")
+                args.append(low)
+            if high is not None:
+                where.append(f"{field} <= ?")
+                args.append(high)
+        sql = f"SELECT {self.key} FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {self.key}"
+        return [row[0] for row in self.db.conn.execute(sql, args)]
+
+    async def run(self, fn, *args):
+        return await self.db.run(fn, *args)
+
+
+class SortedIndex:
+    """Отсортированный индекс (значение, id) по числовому полю: диапазон за O(log n + k)"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self._value = attrgetter(field)
+        self._entries: list[tuple[int, int]] = []
+        # Проиндексированное значение по id: запись могла измениться на месте
+        self._values: dict[int, int] = {}
+
+    def rebuild(self, items):
+        self._values = {item.id: value for item in items if (value := self._value(item)) is not None}
+        self._entries = sorted((value, lot_id) for lot_id, value in self._values.items())
+
+    def add(self, item: Lot):
+        if item.id in self._values:
+            self.remove(item)
+        value = self._value(item)
+        if value is not None:
+            self._values[item.id] = value
+            insort(self._entries, (value, item.id))
+
+    def remove(self, item: Lot):
+        value = self._values.pop(item.id, None)
+        if value is None:
+            return
+        entry = (value, item.id)
+        i = bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def ordered(self, reverse: bool = False) -> list[int]:
+        """Все id по возрастанию (или убыванию) значения"""
+        ids = [lot_id for _, lot_id in self._entries]
+        return ids[::-1] if reverse else ids
+
+    def range(self, low: int | None = None, high: int | None = None) -> list[int]:
+        """id записей с low <= значение <= high в порядке возрастания значения"""
+        start = 0 if low is None else bisect_left(self._entries, (low, -1))
+        end = len(self._entries) if high is None else bisect_right(self._entries, (high, float("inf")))
+        return [lot_id for _, lot_id in self._entries[start:end]]
+
+
+class ConflictError(Exception):
+    """Запись с таким id уже есть или изменилась с момента, когда её прочитали"""
+
+
+class RecordStore:
+    """Записи в памяти — единственный источник правды внутри процесса.
+
+    Хранилище (JSON файл или SQLite) перечитывается только если оно
+    изменилось извне (или по явной команде админа), поиск по id — O(1).
+    Запись отложенная: save() лишь помечает данные изменёнными, а серия
+    изменений сбрасывается в хранилище одной записью вне event loop.
+
+    Обработчики, у которых между чтением и изменением записи есть await,
+    держат блокировку записи (locked) — разные записи при этом меняются
+    параллельно. Если же чтение было в другом обновлении (кнопка в старом
+    сообщении), put/remove принимают expected — отпечаток записи на момент
+    чтения (Record.fingerprint) — и отклоняют изменение через ConflictError,
+    если запись с тех пор поменялась. Отпечаток зависит только от
+    содержимого, поэтому переживает перечитывание и рестарт.
+
+    add/touch/remove принимают метку события (approved, sold, ...): она
+    уходит в хранилище вместе с изменением как история.
+    """
+
+    def __init__(self, backend, model: type[Record], name: str | None = None):
+        self.backend = backend
+        self.model = model
+        self.key = model.KEY
+        self.name = name or model.KEY
+        # Результат последней записи в хранилище (для /health)
+        self.last_write_ok = True
+        self._items: list[Record] = []
+        self._by_id: dict[int, Record] = {}
+        self._positions: dict[int, int] | None = None
+        self._signature = None
+        self._dirty = False
+        self._changed: set[int] = set()
+        self._removed: set[int] = set()
+        self._events: dict[int, str] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._compact_task: asyncio.Task | None = None
+        self._reloading: asyncio.Task | None = None
+        # Пауза перед повтором неудачной записи (0 — последняя запись удалась)
+        self._retry_delay = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._indexes: list = []
+        self.ranges: dict[str, SortedIndex] = {}
+        # Растёт при любом изменении набора записей
+        self.version = 0
+        self._locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def subscribe(self, index):
+        """Подключает индекс, который обновляется при каждом изменении записей"""
+        self._indexes.append(index)
+        if isinstance(index, SortedIndex):
+            self.ranges[index.field] = index
+        index.rebuild(self._items)
+
+    def lock(self, item_id: int) -> asyncio.Lock:
+        lock = self._locks.get(item_id)
+        if lock is None:
+            lock = self._locks[item_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def locked(self, *item_ids: int):
+        """Держит блокировки записей (в порядке id, чтобы не было взаимных ожиданий)"""
+        async with AsyncExitStack() as stack:
+            for item_id in sorted(set(item_ids)):
+                await stack.enter_async_context(self.lock(item_id))
+            yield
+
+    def touch(self, item_id: int, event: str = "updated"):
+        """Помечает запись, изменённую на месте, для записи в хранилище"""
+        item = self._by_id.get(item_id)
+        if item is None:
+            return
+        for index in self._indexes:
+            index.remove(item)
+            index.add(item)
+        self._changed.add(item_id)
+        self._events[item_id] = event
+        self.version += 1
+
+    def _set_items(self, items: list[Record]):
+        self._items = items
+        self._by_id = {item.key: item for item in items}
+        self._positions = None
+        self.version += 1
+        for index in self._indexes:
+            index.rebuild(items)
+
+    async def load(self):
+        """Первичная загрузка: чтение и разбор идут в потоке, не блокируя event loop"""
+        with metrics.timer("vintagebot_storage_seconds", store=self.name, op="load"):
+            signature = await asyncio.to_thread(self.backend.signature)
+            items = await asyncio.to_thread(self.backend.load)
+        self._set_items(items)
+        self._signature = signature
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Перечитывает хранилище, если оно изменилось с момента последнего чтения.
+
+        Чтение и разбор идут в потоке; одновременные вызовы ждут одно и то
+        же перечитывание.
+        """
+        if self._reloading is not None:
+            return await asyncio.shield(self._reloading)
+        if self._dirty or (not force and self._flush_lock.locked()):
+            # В памяти есть несохранённые изменения — они новее хранилища (даже
+            # при force их сначала нужно сбросить); идущая запись меняет подпись
+            # хранилища, но это наша же запись
+            return False
+        # stat файлов / запрос к SQLite — тоже в потоке, не на event loop
+        signature = await asyncio.to_thread(self.backend.signature)
+        if not force and signature is not None and signature == self._signature:
+            return False
+        if self._reloading is not None:
+            # Пока читали подпись, перечитывание запустил другой вызов
+            return await asyncio.shield(self._reloading)
+        self._reloading = asyncio.get_running_loop().create_task(self._reload())
+        return await asyncio.shield(self._reloading)
+
+    async def _reload(self) -> bool:
+        try:
+            async with self._flush_lock:
+                version = self.version
+                with metrics.timer("vintagebot_storage_seconds", store=self.name, op="load"):
+                    signature = await asyncio.to_thread(self.backend.signature)
+                    items = await asyncio.to_thread(self.backend.load)
+                if self.version != version:
+                    # Пока читали, записи поменялись в памяти: прочитанное устарело,
+                    # перечитаем после их сброса (подпись остаётся старой)
+                    return False
+                self._set_items(items)
+                self._signature = signature
+                return True
+        finally:
+            self._reloading = None
+
+    def save(self):
+        """Помечает данные изменёнными и планирует отложенную запись"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (утилиты, импорт) пишем сразу
+            items = list(self._items)
+            with metrics.timer("vintagebot_storage_seconds", store=self.name, op="write"):
+                ok = self.backend.write_sync(items, *self._take_changes())
+                if ok and self.backend.needs_compaction():
+                    self.backend.compact(items)
+            self._written(ok)
+            self._dirty = not ok
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later(SAVE_DELAY))
+
+    def _take_changes(self) -> tuple[dict[int, Record], set[int], dict[int, str]]:
+        """Изменённые записи (по id), удалённые id и метки событий с прошлого сброса"""
+        changed = {item_id: item for item_id in self._changed if (item := self._by_id.get(item_id)) is not None}
+        removed, events = self._removed, self._events
+        self._changed, self._removed, self._events = set(), set(), {}
+        return changed, removed, events
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Сбрасывает несохранённые изменения в хранилище, не блокируя event loop"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            snapshot = list(self._items)
+            changes = self._take_changes()
+            with metrics.timer("vintagebot_storage_seconds", store=self.name, op="write"):
+                ok = await self.backend.run(self.backend.write_sync, snapshot, *changes)
+            self._written(ok)
+            if not ok:
+                self._restore_changes(*changes)
+                return
+            if self.backend.needs_compaction() and (self._compact_task is None or self._compact_task.done()):
+                self._compact_task = asyncio.get_running_loop().create_task(self.compact())
+
+    async def compact(self):
+        """Фоновое сжатие журнала: новый снимок вместо накопленных записей"""
+        async with self._flush_lock:
+            # Снимок может опередить журнал на несохранённые изменения: их
+            # повторное применение при загрузке ничего не меняет
+            snapshot = list(self._items)
+            with metrics.timer("vintagebot_storage_seconds", store=self.name, op="compact"):
+                ok = await self.backend.run(self.backend.compact, snapshot)
+            if ok:
+                self._track_write()
+
+    def _written(self, ok: bool):
+        self.last_write_ok = ok
+        if ok:
+            self._retry_delay = 0.0
+            self._track_write()
+        else:
+            metrics.inc("vintagebot_storage_errors_total", store=self.name)
+
+    def _track_write(self):
+        """Подпись хранилища после собственной записи.
+
+        Если перед нашей записью хранилище уже изменил кто-то другой (другой
+        воркер), новую подпись не принимаем — иначе его изменения так и не
+        были бы прочитаны; следующий refresh перечитает всё.
+        """
+        before, after = self.backend.last_write
+        self._signature = after if before == self._signature else None
+
+    def _restore_changes(self, changed: dict[int, Record], removed: set[int], events: dict[int, str]):
+        """Возвращает несохранённые изменения после неудачной записи и планирует повтор"""
+        self._dirty = True
+        self._changed |= changed.keys() - self._removed
+        self._removed |= removed - self._changed
+        self._events = {**events, **self._events}
+        self._retry_delay = min(SAVE_RETRY_MAX, max(SAVE_DELAY, 1.0, self._retry_delay * 2))
+        task = self._flush_task
+        if task is None or task.done() or task is asyncio.current_task():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later(self._retry_delay))
+        logger.warning(f"{self.name}: запись не удалась, повтор через {self._retry_delay:.0f} с")
+
+    @staticmethod
+    async def flush_together(*stores: "RecordStore"):
+        """Сбрасывает несколько хранилищ; в общей SQLite базе — одной транзакцией"""
+        dbs = {getattr(store.backend, "db", None) for store in stores}
+        if len(dbs) != 1 or None in dbs:
+            # JSON: у каждого хранилища свой файл, каждый пишется атомарно
+            for store in stores:
+                await store.flush()
+            return
+        db = dbs.pop()
+        async with AsyncExitStack() as stack:
+            for store in stores:
+                await stack.enter_async_context(store._flush_lock)
+            batch = []
+            for store in stores:
+                if store._dirty:
+                    store._dirty = False
+                    batch.append((store, list(store._items), *store._take_changes()))
+            if not batch:
+                return
+            names = "+".join(store.name for store, *_ in batch)
+            with metrics.timer("vintagebot_storage_seconds", store=names, op="write"):
+                ok = await db.run(db.write_batch, [(store.backend, *rest) for store, *rest in batch])
+            for store, _, *changes in batch:
+                store._written(ok)
+                if not ok:
+                    store._restore_changes(*changes)
+
+    async def close(self):
+        """Сохраняет всё немедленно и снимает отложенную запись"""
+        await self.flush()
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._compact_task is not None:
+            await self._compact_task
+
+    def get(self, item_id: int) -> Record | None:
+        return self._by_id.get(item_id)
 
-# Загружаем данные при старте
-catalog: list[dict] = load_json(CATALOG_FILE)
-pending: list[dict] = load_json(PENDING_FILE)
+    def position(self, item_id: int) -> int | None:
+        """Порядковый номер записи (индекс позиций строится лениво после удалений)"""
+        if self._positions is None:
+            self._positions = {item.key: i for i, item in enumerate(self._items)}
+        return self._positions.get(item_id)
 
-def reload_catalog():
-    """Перезагружает каталог из файла"""
-    global catalog
-    catalog = load_json(CATALOG_FILE)
+    def add(self, item: Record, event: str = "added"):
+        if item.key in self._by_id:
+            raise ConflictError(f"Запись {item.key} уже существует")
+        if self._positions is not None:
+            self._positions[item.key] = len(self._items)
+        self._items.append(item)
+        self._by_id[item.key] = item
+        self._changed.add(item.key)
+        self._removed.discard(item.key)
+        self._events[item.key] = event
+        self.version += 1
+        for index in self._indexes:
+            index.add(item)
+
+    def put(self, item: Record, event: str = "updated", expected: str | None = None) -> bool:
+        """Добавляет запись или подменяет существующую с тем же id (True — если подменила)"""
+        old = self._by_id.get(item.key)
+        self._check_expected(old, expected)
+        if old is None:
+            self.add(item, event)
+            return False
+        self._items[self.position(item.key)] = item
+        self._by_id[item.key] = item
+        for index in self._indexes:
+            index.remove(old)
+            index.add(item)
+        self._changed.add(item.key)
+        self._events[item.key] = event
+        self.version += 1
+        return True
+
+    @staticmethod
+    def _check_expected(item: Record | None, expected: str | None):
+        if expected is not None and item is not None and item.fingerprint() != expected:
+            raise ConflictError(f"Запись {item.key} изменена после чтения")
+
+    def remove(self, item_id: int, event: str = "removed", expected: str | None = None) -> Record | None:
+        """Удаляет запись; None — если её уже нет, ConflictError — если она изменилась (expected)"""
+        self._check_expected(self._by_id.get(item_id), expected)
+        item = self._by_id.pop(item_id, None)
+        if item is not None:
+            self._items = [x for x in self._items if x.key != item_id]
+            self._positions = None
+            self._changed.discard(item_id)
+            self._removed.add(item_id)
+            self._events[item_id] = event
+            self.version += 1
+            for index in self._indexes:
+                index.remove(item)
+        return item
+
+    def remove_many(self, item_ids, event: str = "removed") -> list[Record]:
+        """Удаляет пачку записей за один проход по списку"""
+        removed = [item for item_id in item_ids if (item := self._by_id.pop(item_id, None)) is not None]
+        if removed:
+            gone = {item.key for item in removed}
+            self._items = [x for x in self._items if x.key not in gone]
+            self._positions = None
+            self._changed -= gone
+            self._removed |= gone
+            for item_id in gone:
+                self._events[item_id] = event
+            self.version += 1
+            for item in removed:
+                for index in self._indexes:
+                    index.remove(item)
+        return removed
+
+    async def find_ids(
+        self,
+        city: str | None = None,
+        price_min: int | None = None,
+        price_max: int | None = None,
+        year_min: int | None = None,
+        year_max: int | None = None,
+    ) -> list[int]:
+        """id записей по городу, диапазонам цены и года — в порядке каталога.
+
+        В SQLite — запросом по индексам, в памяти — через SortedIndex.
+        """
+        ranges = {}
+        if price_min is not None or price_max is not None:
+            ranges["price_value"] = (price_min, price_max)
+        if year_min is not None or year_max is not None:
+            ranges["year_value"] = (year_min, year_max)
+        if self.backend.indexed:
+            await self.flush()
+            return await self.backend.run(self.backend.find_ids, city, ranges)
+        candidates = None
+        for field, (low, high) in ranges.items():
+            ids = set(self.ranges[field].range(low, high))
+            candidates = ids if candidates is None else candidates & ids
+        if candidates is None:
+            items = self._items
+        else:
+            items = sorted((self._by_id[i] for i in candidates), key=attrgetter("key"))
+        return [item.key for item in items if city is None or item.city == city]
+
+    def max_id(self) -> int:
+        return max(self._by_id, default=0)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+
+LOT_COLUMNS = ("title", "year", "condition", "size", "city", "price", "comment", "owner_id")
+PENDING_COLUMNS = (
+    "owner_id", "owner_username", "title", "year", "condition", "size", "city", "price", "comment",
+)
+
+def import_json_to_sqlite(db: SqliteDatabase, force: bool = False) -> tuple[int, int]:
+    """Разовый перенос catalog.json / pending.json в SQLite (только в пустые таблицы)"""
+    db.open()
+    counts = []
+    for path, table, model, columns in (
+        (CATALOG_FILE, "lots", Lot, LOT_COLUMNS),
+        (PENDING_FILE, "pending", PendingItem, PENDING_COLUMNS),
+    ):
+        backend = SqliteBackend(db, table, model, columns)
+        has_rows = db.call(lambda: db.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone())
+        if (has_rows and not force) or not path.exists():
+            counts.append(0)
+            continue
+        # Снимок вместе с журналом — текущее состояние JSON хранилища
+        items = JournalBackend(path, model, fresh_ids=partial(reserve_ids, db, table)).load()
+        db.call(backend.write_sync, items, {item.key: item for item in items}, set(), dict.fromkeys(
+            (item.key for item in items), "imported"
+        ))
+        # Счётчик не должен отставать от импортированных id
+        db.call(db.write_sequence, table, max((item.key for item in items), default=0))
+        logger.info(f"Импортировано {len(items)} записей из {path} в таблицу {table}")
+        counts.append(len(items))
+    return counts[0], counts[1]
+
+class JsonSequences:
+    """Счётчики id в отдельном маленьком JSON файле (атомарная запись)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._values: dict[str, int] | None = None
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, int]:
+        if self._values is None:
+            try:
+                self._values = json.loads(self.path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                self._values = {}
+            except Exception as e:
+                # Без файла счётчики заново отсчитываются от данных
+                logger.exception(f"Ошибка чтения {self.path}: {e}")
+                self._values = {}
+        return self._values
+
+    def _write(self, values: dict[str, int]):
+        if not save_json(self.path, values):
+            raise OSError(f"Не удалось сохранить {self.path}")
+        self._values = values
+
+    def read_sequence(self, name: str) -> int | None:
+        with self._lock:
+            return self._read().get(name)
+
+    def write_sequence(self, name: str, value: int):
+        with self._lock:
+            values = dict(self._read())
+            values[name] = max(value, values.get(name, 0))
+            self._write(values)
+
+    def reserve_sequence(self, name: str, size: int, floor: int) -> int:
+        with self._lock:
+            values = dict(self._read())
+            values[name] = values.get(name, floor) + size
+            self._write(values)
+            return values[name]
+
+    def call(self, fn, *args):
+        return fn(*args)
+
+    async def run(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+
+def reserve_ids(sequences, name: str, count: int, floor: int) -> list[int]:
+    """Синхронно резервирует count id в счётчике name (для миграций при загрузке).
+
+    Тот же атомарный сдвиг, что у IdAllocator, так что его блоки с этими
+    id не пересекутся. floor — начальное значение, если счётчика ещё нет.
+    """
+    ceiling = sequences.call(sequences.reserve_sequence, name, count, floor)
+    return list(range(ceiling - count + 1, ceiling + 1))
+
+
+class IdAllocator:
+    """Монотонный счётчик id: выдача за O(1), в хранилище пишется лишь граница блока.
+
+    Блок резервируется атомарным сдвигом сохранённого счётчика, поэтому id
+    не повторяются ни после рестарта (в т.ч. аварийного), ни между
+    процессами-воркерами — в худшем случае остаётся пропуск до ID_BLOCK
+    номеров. При первом запуске счётчик начинается с максимального id в данных.
+    """
+
+    def __init__(self, sequences, name: str, seed, block: int = ID_BLOCK):
+        self.sequences = sequences
+        self.name = name
+        self.seed = seed
+        self.block = max(1, block)
+        self._next = 0
+        self._limit = 0
+        self._floor: int | None = None
+        self._lock = asyncio.Lock()
+
+    async def take(self, count: int = 1) -> list[int]:
+        if self._next + count > self._limit:
+            async with self._lock:
+                if self._next + count > self._limit:
+                    await self._reserve(count)
+        ids = list(range(self._next, self._next + count))
+        self._next += count
+        return ids
+
+    async def next(self) -> int:
+        return (await self.take())[0]
+
+    async def skip_to(self, value: int):
+        """Сдвигает счётчик за value — id, занятые импортом, больше не выдаются"""
+        await self.sequences.run(self.sequences.write_sequence, self.name, max(value, self.seed()))
+        if self._next <= value:
+            # Взятый блок пересекается с занятыми id: следующий take() возьмёт новый
+            self._next = self._limit = 0
+
+    async def _reserve(self, count: int):
+        if self._floor is None:
+            stored = await self.sequences.run(self.sequences.read_sequence, self.name)
+            # Начальное значение нужно, только если счётчика ещё нет
+            self._floor = self.seed() if stored is None else 0
+        size = max(count, self.block)
+        ceiling = await self.sequences.run(self.sequences.reserve_sequence, self.name, size, self._floor)
+        self._next = ceiling - size + 1
+        self._limit = ceiling + 1
+
+
+# ========================== Поиск ================================
+WORD_RE = re.compile(r"\w+")
+
+def search_tokens(text) -> list[str]:
+    """Слова для поиска: нижний регистр, «ё» приравнена к «е»"""
+    return WORD_RE.findall(str(text or "").lower().replace("ё", "е"))
+
+
+class SearchIndex:
+    """Инвертированный индекс по лотам: слово -> {id лота: вес}.
+
+    Короткие запросы ищутся по префиксу в отсортированном словаре, длинные —
+    через триграммы слов, так что «ботин» находит «ботинки», а «тинки» —
+    тоже. Стоимость запроса зависит от числа совпадений, а не от размера
+    каталога.
+    """
+
+    # Вес поля в ранжировании
+    FIELDS = {"title": 5, "city": 2, "year": 2, "condition": 1, "comment": 1}
+
+    def __init__(self):
+        self._postings: dict[str, dict[int, int]] = defaultdict(dict)
+        self._trigrams: dict[str, set[str]] = defaultdict(set)
+        self._vocabulary: list[str] = []
+        self._doc_tokens: dict[int, set[str]] = {}
+
+    @staticmethod
+    def _grams(word: str) -> set[str]:
+        return {word[i:i + 3] for i in range(len(word) - 2)}
+
+    def rebuild(self, items):
+        self._postings.clear()
+        self._trigrams.clear()
+        self._vocabulary = []
+        self._doc_tokens.clear()
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Lot):
+        lot_id = item.id
+        if lot_id in self._doc_tokens:
+            self.remove(item)
+        tokens = set()
+        for field, weight in self.FIELDS.items():
+            value = getattr(item, field)
+            if field == "comment" and value == "-":
+                continue
+            for word in search_tokens(value):
+                postings = self._postings[word]
+                if not postings:
+                    insort(self._vocabulary, word)
+                    for gram in self._grams(word):
+                        self._trigrams[gram].add(word)
+                postings[lot_id] = postings.get(lot_id, 0) + weight
+                tokens.add(word)
+        self._doc_tokens[lot_id] = tokens
+
+    def remove(self, item: Lot):
+        lot_id = item.id
+        for word in self._doc_tokens.pop(lot_id, ()):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(lot_id, None)
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect_left(self._vocabulary, word)]
+                for gram in self._grams(word):
+                    words = self._trigrams.get(gram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self._trigrams[gram]
+
+    def _matching_words(self, term: str) -> list[tuple[str, float]]:
+        """Слова словаря, подходящие под термин, с коэффициентом точности"""
+        matches = []
+        if len(term) < 3:
+            i = bisect_left(self._vocabulary, term)
+            while i < len(self._vocabulary) and self._vocabulary[i].startswith(term):
+                word = self._vocabulary[i]
+                matches.append((word, 1.0 if word == term else 0.6))
+                i += 1
+            return matches
+        grams = sorted(self._grams(term), key=lambda g: len(self._trigrams.get(g, ())))
+        candidates = set(self._trigrams.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self._trigrams.get(gram, set())
+        for word in candidates:
+            if word == term:
+                matches.append((word, 1.0))
+            elif word.startswith(term):
+                matches.append((word, 0.6))
+            elif term in word:
+                matches.append((word, 0.3))
+        return matches
+
+    def search(self, query: str) -> list[int]:
+        """id лотов, где встречаются все слова запроса, лучшие совпадения первыми"""
+        terms = search_tokens(query)
+        if not terms:
+            return []
+        scores: dict[int, float] | None = None
+        for term in dict.fromkeys(terms):
+            term_scores: dict[int, float] = {}
+            for word, quality in self._matching_words(term):
+                for lot_id, weight in self._postings[word].items():
+                    if scores is not None and lot_id not in scores:
+                        continue
+                    score = weight * quality
+                    if score > term_scores.get(lot_id, 0):
+                        term_scores[lot_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {lot_id: scores[lot_id] + s for lot_id, s in term_scores.items()}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda lot_id: (-scores[lot_id], lot_id))
+
+
+# ========================== Фасеты ===============================
+CITY_PAGE_SIZE = 10
+# Написания, которые означают один и тот же город (ключи уже нормализованы)
+CITY_ALIASES = {
+    "moscow": "москва",
+    "мск": "москва",
+    "saint petersburg": "санкт-петербург",
+    "st petersburg": "санкт-петербург",
+    "санкт петербург": "санкт-петербург",
+    "спб": "санкт-петербург",
+    "питер": "санкт-петербург",
+}
+
+def city_key(text) -> str:
+    """Нормализованный город: регистр, «ё», лишние пробелы и точки не важны"""
+    key = " ".join(str(text or "").lower().replace("ё", "е").replace(".", " ").split())
+    key = re.sub(r"^(г|город) ", "", key)
+    return CITY_ALIASES.get(key, key)
+
+
+def facet_id(key: str) -> str:
+    """Короткий id значения фасета для callback_data: не зависит от процесса и перезапуска"""
+    return hashlib.blake2b(key.encode(), digest_size=5).hexdigest()
+
+
+class CityFacet:
+    """Фасет «город»: нормализованный ключ -> id лотов, название и число лотов.
+
+    Обновляется вместе с каталогом (add/remove), так что меню городов
+    не перебирает лоты. Название города — самое частое написание среди
+    его лотов. Упорядоченный список городов пересчитывается лениво,
+    только после изменения состава.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, set[int]] = {}
+        self._spellings: dict[str, Counter] = {}
+        self._keys: dict[int, tuple[str, str]] = {}
+        self._by_fid: dict[str, str] = {}
+        self._ordered: list[str] | None = None
+
+    def rebuild(self, items):
+        self._ids.clear()
+        self._spellings.clear()
+        self._keys.clear()
+        self._by_fid.clear()
+        self._ordered = None
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Lot):
+        if item.id in self._keys:
+            self.remove(item)
+        name = " ".join(str(item.city or "").split())
+        key = city_key(name)
+        if not key:
+            return
+        ids = self._ids.get(key)
+        if ids is None:
+            ids = self._ids[key] = set()
+            self._spellings[key] = Counter()
+            self._by_fid[facet_id(key)] = key
+        ids.add(item.id)
+        self._spellings[key][name] += 1
+        self._keys[item.id] = (key, name)
+        self._ordered = None
+
+    def remove(self, item: Lot):
+        entry = self._keys.pop(item.id, None)
+        if entry is None:
+            return
+        key, name = entry
+        ids = self._ids[key]
+        ids.discard(item.id)
+        if not ids:
+            del self._ids[key]
+            del self._spellings[key]
+            del self._by_fid[facet_id(key)]
+        else:
+            spellings = self._spellings[key]
+            spellings[name] -= 1
+            if spellings[name] <= 0:
+                del spellings[name]
+        self._ordered = None
+
+    def name(self, key: str) -> str:
+        return self._spellings[key].most_common(1)[0][0]
+
+    def key_of(self, fid: str) -> str | None:
+        return self._by_fid.get(fid)
+
+    def count(self, key: str) -> int:
+        return len(self._ids.get(key, ()))
+
+    def ids(self, key: str) -> list[int]:
+        """id лотов города в порядке каталога"""
+        return sorted(self._ids.get(key, ()))
+
+    def ordered(self) -> list[str]:
+        """Ключи городов: сначала города с большим числом лотов"""
+        if self._ordered is None:
+            self._ordered = sorted(self._ids, key=lambda key: (-len(self._ids[key]), key))
+        return self._ordered
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+# ========================== Курсоры выдачи =======================
+class ResultCursor:
+    """Сохранённая выдача фильтра или поиска: список стабильных id лотов"""
+
+    __slots__ = ("rid", "ids", "expires", "version")
+
+    def __init__(self, rid: str, ids: list[int], version: int):
+        self.rid = rid
+        self.ids = ids
+        self.version = version
+        self.expires = time.monotonic() + CURSOR_TTL
+
+
+class CursorRegistry:
+    """Курсоры на стороне сервера: в callback_data уходит только короткий rid.
+
+    Выдача считается один раз; листание вперёд/назад лишь двигает позицию.
+    Курсор хранит id, а не позиции в каталоге, поэтому удаление лотов его
+    не ломает: удалённые id выбрасываются при следующем обращении.
+    """
+
+    def __init__(self, store: "RecordStore", ttl: int = CURSOR_TTL, limit: int = CURSOR_LIMIT):
+        self.store = store
+        self.ttl = ttl
+        self.limit = limit
+        self._cursors: OrderedDict[str, ResultCursor] = OrderedDict()
+
+    def create(self, ids: list[int]) -> ResultCursor:
+        rid = secrets.token_urlsafe(6)
+        cursor = ResultCursor(rid, list(ids), self.store.version)
+        self._cursors[rid] = cursor
+        while len(self._cursors) > self.limit:
+            self._cursors.popitem(last=False)
+        return cursor
+
+    def get(self, rid: str) -> ResultCursor | None:
+        cursor = self._cursors.get(rid)
+        if cursor is None:
+            return None
+        now = time.monotonic()
+        if cursor.expires < now:
+            del self._cursors[rid]
+            return None
+        if cursor.version != self.store.version:
+            cursor.ids = [lot_id for lot_id in cursor.ids if self.store.get(lot_id) is not None]
+            cursor.version = self.store.version
+        cursor.expires = now + self.ttl
+        self._cursors.move_to_end(rid)
+        return cursor
+
+
+# Хранилища создаются пустыми; данные грузит load_data() после старта сервера
+if STORAGE_BACKEND == "sqlite":
+    db = SqliteDatabase(DB_FILE)
+    sequences = db
+    catalog = RecordStore(SqliteBackend(db, "lots", Lot, LOT_COLUMNS), Lot, name="catalog")
+    pending = RecordStore(
+        SqliteBackend(db, "pending", PendingItem, PENDING_COLUMNS), PendingItem, name="pending",
+    )
+else:
+    db = None
+    sequences = JsonSequences(SEQUENCES_FILE)
+    catalog = RecordStore(
+        JournalBackend(CATALOG_FILE, Lot, fresh_ids=partial(reserve_ids, sequences, "lots")), Lot, name="catalog",
+    )
+    pending = RecordStore(
+        JournalBackend(PENDING_FILE, PendingItem, fresh_ids=partial(reserve_ids, sequences, "pending")),
+        PendingItem, name="pending",
+    )
+search_index = SearchIndex()
+price_index = SortedIndex("price_value")
+year_index = SortedIndex("year_value")
+catalog.subscribe(search_index)
+catalog.subscribe(price_index)
+catalog.subscribe(year_index)
+city_facet = CityFacet()
+catalog.subscribe(city_facet)
+cursors = CursorRegistry(catalog)
+
+data_ready = asyncio.Event()
+warmup_error: str | None = None
+_warmup_task: asyncio.Task | None = None
+
+async def load_data():
+    """Первичная загрузка каталога и заявок (в фоне, порт к этому моменту уже открыт)"""
+    global warmup_error
+    try:
+        if db is not None:
+            await asyncio.to_thread(import_json_to_sqlite, db)
+        else:
+            await asyncio.to_thread(init_json_files)
+        await catalog.load()
+        await pending.load()
+        logger.info(f"Загружено лотов: {len(catalog)}, заявок на модерацию: {len(pending)}")
+        data_ready.set()
+    except Exception as e:
+        warmup_error = repr(e)
+        logger.exception("Ошибка загрузки данных")
+
+def start_warmup() -> asyncio.Task:
+    """Запускает загрузку данных один раз; повторный вызов вернёт ту же задачу"""
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(load_data())
+    return _warmup_task
+
+async def reload_catalog() -> RecordStore:
+    """Перечитывает каталог, только если хранилище изменилось извне"""
+    await catalog.refresh()
     return catalog
 
-def reload_pending():
-    """Перезагружает pending из файла"""
-    global pending
-    pending = load_json(PENDING_FILE)
+async def reload_pending() -> RecordStore:
+    """Перечитывает pending, только если хранилище изменилось извне"""
+    await pending.refresh()
     return pending
 
 def save_catalog():
     """Сохраняет каталог в файл"""
-    save_json(CATALOG_FILE, catalog)
+    catalog.save()
 
 def save_pending():
     """Сохраняет pending в файл"""
-    save_json(PENDING_FILE, pending)
+    pending.save()
 
-def next_lot_id() -> int:
-    if not catalog:
-        return 1
-    return max(item["id"] for item in catalog) + 1
+lot_seq = IdAllocator(sequences, "lots", catalog.max_id)
+pending_seq = IdAllocator(sequences, "pending", pending.max_id)
+
+async def next_lot_id() -> int:
+    return await lot_seq.next()
 
 # ========================== FSM =================================
 class Form(StatesGroup):
@@ -123,22 +1934,458 @@ class Form(StatesGroup):
     comment = State()
     comment_confirm = State()
 
-class BuyAddress(StatesGroup):
-    waiting = State()
+class BuyAddress(StatesGroup):
+    waiting = State()
+
+class Support(StatesGroup):
+    waiting = State()
+
+class SearchState(StatesGroup):
+    waiting = State()
+
+# ========================== Хранилище FSM =========================
+class SqliteFSMStorage(BaseStorage):
+    """Состояния и данные форм в SQLite, чтобы рестарт не терял заявки.
+
+    Чтение и запись идут через кэш в памяти; изменения сбрасываются в базу
+    отложенно, одной транзакцией на серию. Записи, к которым не обращались
+    дольше FSM_TTL, удаляются из базы, а кэш ограничен FSM_CACHE_LIMIT.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fsm (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fsm_updated ON fsm(updated);
+    """
+
+    def __init__(self, path: Path, ttl: int = FSM_TTL, cache_limit: int = FSM_CACHE_LIMIT):
+        self.db = SqliteDatabase(path, schema=self.SCHEMA, migrations=())
+        self.ttl = ttl
+        self.cache_limit = cache_limit
+        self._keys = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # key -> [state, data, updated]
+        self._cache: OrderedDict[str, list] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._last_sweep = 0.0
+
+    def _load_row(self, key: str):
+        return self.db.conn.execute("SELECT state, data, updated FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    async def _record(self, key: StorageKey) -> tuple[str, list]:
+        k = self._keys.build(key)
+        record = self._cache.get(k)
+        if record is not None:
+            self._cache.move_to_end(k)
+            return k, record
+        await self.db.open_async()
+        row = await self.db.run(self._load_row, k)
+        if row is not None and row["updated"] >= time.time() - self.ttl:
+            loaded = [row["state"], json.loads(row["data"]), row["updated"]]
+        else:
+            loaded = [None, {}, time.time()]
+        # Пока шло чтение, запись могла появиться в кэше — она новее
+        record = self._cache.setdefault(k, loaded)
+        self._evict()
+        return k, record
+
+    def _evict(self):
+        while len(self._cache) > self.cache_limit:
+            for k in self._cache:
+                if k not in self._dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    def _changed(self, k: str, record: list):
+        record[2] = time.time()
+        self._dirty.add(k)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        await self.flush()
+
+    def _write(self, rows: list[tuple], sweep_before: float | None):
+        with self.db.conn:
+            for k, state, data, updated in rows:
+                if state is None and data == "{}":
+                    self.db.conn.execute("DELETE FROM fsm WHERE key = ?", (k,))
+                else:
+                    self.db.conn.execute(
+                        "INSERT OR REPLACE INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?)",
+                        (k, state, data, updated),
+                    )
+            if sweep_before is not None:
+                removed = self.db.conn.execute("DELETE FROM fsm WHERE updated < ?", (sweep_before,)).rowcount
+                if removed:
+                    logger.info(f"Удалено брошенных форм: {removed}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            now = time.time()
+            sweep_before = None
+            if now - self._last_sweep > 600:
+                self._last_sweep = now
+                sweep_before = now - self.ttl
+                for k in [k for k, r in self._cache.items() if r[2] < sweep_before and k not in self._dirty]:
+                    del self._cache[k]
+            if not self._dirty and sweep_before is None:
+                return
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for k in dirty:
+                record = self._cache.get(k)
+                if record is not None:
+                    rows.append((k, record[0], json.dumps(record[1], ensure_ascii=False), record[2]))
+            await self.db.open_async()
+            try:
+                await self.db.run(self._write, rows, sweep_before)
+            except Exception as e:
+                logger.exception(f"Ошибка записи состояний FSM: {e}")
+                self._dirty |= dirty
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        k, record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._changed(k, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._record(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Данные FSM должны быть dict, получено {type(data).__name__}")
+        k, record = await self._record(key)
+        record[1] = data.copy()
+        self._changed(k, record)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, record = await self._record(key)
+        return record[1].copy()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self.db.conn is not None:
+            self.db.close()
+
+
+# ========================== Исходящие запросы ====================
+# Приоритеты отправки: меньше — раньше
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BACKGROUND = 2
+
+# Явный приоритет для текущей задачи (иначе выбирается по получателю)
+send_priority: ContextVar[int | None] = ContextVar("send_priority", default=None)
+
+
+class TokenBucket:
+    """Ведро токенов: rate запросов в секунду, не больше capacity подряд"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 — есть сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Единая очередь исходящих запросов к Bot API.
+
+    Подключается к сессии бота, поэтому через неё проходят все вызовы
+    с chat_id (send_*, edit_*, delete_message...). Глобальное ведро держит
+    общий лимит бота, ведро на чат — лимит одного чата. Правки и удаления
+    (edit_*, delete_message) новых сообщений не шлют и ведро чата не тратят:
+    иначе админ, разбирающий очередь, ждал бы каждую правку карточки по
+    секунде. Пауза чата после 429 действует и на них. Ожидающие запросы
+    выдаются по приоритету: ответы пользователям раньше уведомлений админу.
+    На 429 чат (или весь бот) ставится на паузу retry_after и запрос
+    повторяется, а не теряется.
+    """
+
+    CHAT_BUCKETS_LIMIT = 10000
+
+    def __init__(self):
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._chats: OrderedDict[int | str, TokenBucket] = OrderedDict()
+        self._queue: asyncio.PriorityQueue | None = None
+        self._worker: asyncio.Task | None = None
+        self._seq = 0
+        self.delayed = 0
+        # Метрики
+        self.requests = 0
+        self.throttled = 0
+        self.throttle_delay_total = 0.0
+        self.throttle_delay_max = 0.0
+        self.retry_after_count = 0
+        self.dropped = 0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = SEND_GROUP_RATE if group else SEND_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, 3)
+            while len(self._chats) > self.CHAT_BUCKETS_LIMIT:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    @property
+    def queue_depth(self) -> int:
+        return (self._queue.qsize() if self._queue is not None else 0) + self.delayed
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queue_depth": self.queue_depth,
+            "throttled": self.throttled,
+            "throttle_delay_avg": self.throttle_delay_total / self.throttled if self.throttled else 0.0,
+            "throttle_delay_max": self.throttle_delay_max,
+            "retry_after": self.retry_after_count,
+            "dropped": self.dropped,
+        }
+
+    def pause(self, chat_id: int | str | None, seconds: float):
+        until = time.monotonic() + seconds
+        bucket = self._global if chat_id is None else self._chat_bucket(chat_id)
+        bucket.paused_until = max(bucket.paused_until, until)
+
+    def _chat_delay(self, chat_id: int | str, counted: bool, now: float) -> float:
+        bucket = self._chat_bucket(chat_id)
+        return bucket.delay(now) if counted else max(0.0, bucket.paused_until - now)
+
+    def _take(self, chat_id: int | str, counted: bool):
+        self._global.take()
+        if counted:
+            self._chat_bucket(chat_id).take()
+
+    async def acquire(self, chat_id: int | str, priority: int, counted: bool = True):
+        """Ждёт разрешения на отправку в чат с учётом лимитов и приоритета.
+
+        counted=False — запрос не тратит ведро чата (правка, удаление).
+        """
+        now = time.monotonic()
+        if not self.queue_depth and not self._global.delay(now) and not self._chat_delay(chat_id, counted, now):
+            self._take(chat_id, counted)
+            return
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._queue.put_nowait((priority, self._seq, chat_id, counted, future))
+        await future
+        waited = time.monotonic() - now
+        if waited > 0.001:
+            self.throttled += 1
+            self.throttle_delay_total += waited
+            self.throttle_delay_max = max(self.throttle_delay_max, waited)
+
+    def _requeue(self, item):
+        self.delayed -= 1
+        self._queue.put_nowait(item)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            _, _, chat_id, counted, future = item
+            if future.done():
+                continue
+            now = time.monotonic()
+            wait = self._chat_delay(chat_id, counted, now)
+            if wait > 0:
+                # Чат упёрся в лимит — откладываем только его, остальные идут дальше
+                self.delayed += 1
+                loop.call_later(wait, self._requeue, item)
+                continue
+            wait = self._global.delay(now)
+            if wait > 0:
+                # Общий лимит: возвращаем запрос в очередь, чтобы после паузы
+                # первым ушёл самый приоритетный
+                self._queue.put_nowait(item)
+                await asyncio.sleep(wait)
+                continue
+            self._take(chat_id, counted)
+            future.set_result(None)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # answer_callback_query, get_*, set_webhook — без очереди
+            return await make_request(bot, method)
+        priority = send_priority.get()
+        if priority is None:
+            priority = PRIORITY_ADMIN if chat_id == ADMIN_ID else PRIORITY_USER
+        counted = not method.__api_method__.startswith(("edit", "delete"))
+        self.requests += 1
+        for attempt in range(SEND_RETRIES + 1):
+            await self.acquire(chat_id, priority, counted)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                if attempt == SEND_RETRIES:
+                    self.dropped += 1
+                    raise
+                logger.warning(f"429 в чате {chat_id}, повтор через {e.retry_after} с")
+                self.pause(chat_id, e.retry_after)
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Считает каждый реальный вызов Bot API (включая повторы после 429) и его время"""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        result = "ok"
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            result = "retry_after"
+            raise
+        except TelegramAPIError:
+            result = "error"
+            raise
+        except Exception:
+            result = "network"
+            raise
+        finally:
+            metrics.observe("vintagebot_api_seconds", time.perf_counter() - start, method=name)
+            metrics.inc("vintagebot_api_calls_total", method=name, result=result)
+
+
+class UpdateMetrics(BaseMiddleware):
+    """Внешний middleware диспетчера: тип обновления, префикс callback, полное время"""
+
+    PREFIX_LIMIT = 50
+
+    def __init__(self):
+        self._prefixes: set[str] = set()
+
+    def prefix(self, update: types.Update) -> str:
+        query = update.callback_query
+        if query is None or not query.data:
+            return ""
+        prefix = query.data.split(":", 1)[0]
+        # Префиксы приходят от клиента: не даём им раздуть число рядов метрики
+        if prefix not in self._prefixes:
+            if len(self._prefixes) >= self.PREFIX_LIMIT:
+                return "other"
+            self._prefixes.add(prefix)
+        return prefix
+
+    async def __call__(self, handler, event: types.Update, data: dict):
+        kind = event.event_type
+        metrics.inc("vintagebot_updates_total", type=kind, prefix=self.prefix(event))
+        with metrics.timer("vintagebot_update_seconds", type=kind):
+            return await handler(event, data)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Внутренний middleware: время и ошибки конкретного обработчика"""
+
+    async def __call__(self, handler, event, data: dict):
+        name = data["handler"].callback.__name__
+        try:
+            with metrics.timer("vintagebot_handler_seconds", handler=name):
+                return await handler(event, data)
+        except Exception:
+            metrics.inc("vintagebot_handler_errors_total", handler=name)
+            raise
+
+
+class WarmupGate(BaseMiddleware):
+    """Пока данные грузятся, обновления ждут их готовности (не дольше WARMUP_WAIT)"""
+
+    async def __call__(self, handler, event: types.Update, data: dict):
+        if not data_ready.is_set():
+            try:
+                await asyncio.wait_for(data_ready.wait(), WARMUP_WAIT)
+            except asyncio.TimeoutError:
+                await self.reply_warming(event, data)
+                return None
+        return await handler(event, data)
+
+    @staticmethod
+    async def reply_warming(event: types.Update, data: dict):
+        text = "⏳ Бот просыпается, повторите через несколько секунд."
+        try:
+            if event.callback_query is not None:
+                await event.callback_query.answer(text, show_alert=True)
+            elif data.get("event_chat") is not None:
+                await bot.send_message(data["event_chat"].id, text)
+        except Exception as e:
+            logger.warning(f"Не удалось ответить во время прогрева: {e}")
+
+
+class LoopLagMonitor:
+    """Раз в interval проверяет, насколько event loop опаздывает с пробуждением"""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.lag = 0.0
+        self._task: asyncio.Task | None = None
 
-class Support(StatesGroup):
-    waiting = State()
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
 
-class SearchState(StatesGroup):
-    waiting = State()
 
 # ========================== Бот / диспетчер ======================
 bot = Bot(
     token=TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
     default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
 )
-storage = MemoryStorage()
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
+# Внутри очереди — считается каждый фактический запрос
+bot.session.middleware(ApiMetrics())
+storage = SqliteFSMStorage(FSM_DB_FILE) if FSM_STORAGE == "sqlite" else MemoryStorage()
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(UpdateMetrics())
+dp.update.outer_middleware(WarmupGate())
+dp.message.middleware(HandlerMetrics())
+dp.callback_query.middleware(HandlerMetrics())
+loop_lag = LoopLagMonitor()
 
 # ========================== Клавиатуры ===========================
 main_kb = ReplyKeyboardMarkup(
@@ -172,44 +2419,101 @@ def yes_no_kb(ok_text: str, edit_text: str) -> ReplyKeyboardMarkup:
         ],
     )
 
-def lot_inline_kb(lot_id: int, current_page: int = None) -> InlineKeyboardMarkup:
+def page_callback(page: int, cursor: str | None = None) -> str:
+    """callback_data страницы: по всему каталогу или внутри курсора выдачи"""
+    return f"cur:{cursor}:{page}" if cursor else f"page:{page}"
+
+def lot_inline_kb(
+    lot_id: int,
+    current_page: int = None,
+    total: int | None = None,
+    cursor: str | None = None,
+) -> InlineKeyboardMarkup:
     """Клавиатура для детального просмотра лота"""
+    if total is None:
+        total = len(catalog)
+    return _lot_inline_kb(lot_id, current_page, total, cursor)
+
+# Клавиатуры зависят только от аргументов, поэтому готовые объекты переиспользуются
+@lru_cache(maxsize=4096)
+def _lot_inline_kb(lot_id: int, current_page: int | None, total: int, cursor: str | None) -> InlineKeyboardMarkup:
     keyboard = [[InlineKeyboardButton(text="🛒 Купить", callback_data=f"buy:{lot_id}")]]
     
     # Кнопки навигации если есть пагинация
     if current_page is not None:
         nav_buttons = []
         if current_page > 0:
-            nav_buttons.append(InlineKeyboardButton(text="◀️ Предыдущий", callback_data=f"page:{current_page-1}"))
-        if current_page < len(catalog) - 1:
-            nav_buttons.append(InlineKeyboardButton(text="Следующий ▶️", callback_data=f"page:{current_page+1}"))
+            nav_buttons.append(InlineKeyboardButton(
+                text="◀️ Предыдущий", callback_data=page_callback(current_page - 1, cursor)
+            ))
+        if current_page < total - 1:
+            nav_buttons.append(InlineKeyboardButton(
+                text="Следующий ▶️", callback_data=page_callback(current_page + 1, cursor)
+            ))
         if nav_buttons:
             keyboard.append(nav_buttons)
     
     keyboard.append([InlineKeyboardButton(text="📦 К каталогу", callback_data="catalog:0")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def catalog_menu_kb(page: int = 0, items_per_page: int = 1) -> InlineKeyboardMarkup:
-    """Создает клавиатуру для галереи лотов с пагинацией"""
+def catalog_menu_kb(
+    page: int = 0,
+    items_per_page: int = 1,
+    total: int | None = None,
+    lot_id: int | None = None,
+    cursor: str | None = None,
+    photo: int = 0,
+    photos: int = 1,
+) -> InlineKeyboardMarkup:
+    """Создает клавиатуру для галереи лотов с пагинацией.
+
+    Для выдачи фильтра или поиска передаются total, lot_id и rid курсора,
+    photo/photos — для листания фото внутри лота.
+    """
+    if total is None:
+        total = len(catalog)
+    if lot_id is None and catalog:
+        lot_id = catalog[min(page * items_per_page, len(catalog) - 1)].id
+    return _catalog_menu_kb(page, items_per_page, total, lot_id, cursor, len(catalog) > 1, photo, photos)
+
+@lru_cache(maxsize=4096)
+def _catalog_menu_kb(
+    page: int,
+    items_per_page: int,
+    total: int,
+    lot_id: int | None,
+    cursor: str | None,
+    show_list: bool,
+    photo: int,
+    photos: int,
+) -> InlineKeyboardMarkup:
     keyboard = []
     
+    # Листание фото текущего лота в том же сообщении
+    if photos > 1:
+        frame = page_callback(page, cursor)
+        keyboard.append([
+            InlineKeyboardButton(text="◀️ 🖼", callback_data=f"{frame}:{(photo - 1) % photos}"),
+            InlineKeyboardButton(text=f"🖼 {photo + 1}/{photos}", callback_data=f"{frame}:{photo}"),
+            InlineKeyboardButton(text="🖼 ▶️", callback_data=f"{frame}:{(photo + 1) % photos}"),
+        ])
+    
     # Кнопки навигации
     nav_buttons = []
     if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"page:{page-1}"))
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=page_callback(page - 1, cursor)))
     
-    if (page + 1) * items_per_page < len(catalog):
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"page:{page+1}"))
+    if (page + 1) * items_per_page < total:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=page_callback(page + 1, cursor)))
     
     if nav_buttons:
         keyboard.append(nav_buttons)
     
     # Кнопка просмотра текущего лота
-    if catalog:
-        current_item = catalog[min(page * items_per_page, len(catalog) - 1)]
+    if lot_id is not None:
         keyboard.append([InlineKeyboardButton(
             text="👁️ Посмотреть", 
-            callback_data=f"lot:{current_item['id']}"
+            callback_data=f"lot:{lot_id}:{cursor}:{page}" if cursor else f"lot:{lot_id}"
         )])
     
     # Кнопки фильтра, поиска и списка
@@ -219,7 +2523,7 @@ def catalog_menu_kb(page: int = 0, items_per_page: int = 1) -> InlineKeyboardMar
     ])
     
     # Кнопка списка всех лотов
-    if len(catalog) > 1:
+    if show_list:
         keyboard.append([InlineKeyboardButton(
             text="📋 Список всех лотов", 
             callback_data="list_all"
@@ -238,6 +2542,237 @@ def approve_kb(pending_id: int) -> InlineKeyboardMarkup:
         ],
     )
 
+# ========================== Рендер карточек ======================
+def render_card_body(item: Lot) -> str:
+    """Подпись карточки в галерее (без строки «Страница X из Y»)"""
+    caption = (
+        f"📦 *ВИНТАЖНАЯ ГАЛЕРЕЯ*\n\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"*{item.title.upper()}*\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n\n"
+        f"📅 {item.year}\n"
+        f"⭐ {item.condition}\n"
+        f"📏 {item.size}\n"
+        f"📍 {item.city}\n\n"
+        f"💰 *{item.price} ₽*\n\n"
+    )
+    
+    if item.comment and item.comment != '-':
+        caption += f"💬 {item.comment}\n\n"
+    return caption
+
+def render_detail_caption(item: Lot) -> str:
+    """Подпись детальной карточки лота"""
+    caption = (
+        f"━━━━━━━━━━━━━━━━━━━━\n"
+        f"*{item.title.upper()}*\n"
+        f"━━━━━━━━━━━━━━━━━━━━\n\n"
+        f"📅 *Год/возраст:* {item.year}\n"
+        f"⭐ *Состояние:* {item.condition}\n"
+        f"📏 *Размер:* {item.size}\n"
+        f"📍 *Город:* {item.city}\n\n"
+        f"💰 *{item.price} ₽*\n\n"
+    )
+    
+    if item.comment and item.comment != '-':
+        caption += f"💬 *Описание:*\n{item.comment}\n\n"
+    
+    caption += f"🆔 Лот №{item.id}"
+    return caption
+
+def album(photos: list[str], caption: str) -> list[InputMediaPhoto]:
+    media = [InputMediaPhoto(media=photos[0], caption=caption, parse_mode="Markdown")]
+    for p in photos[1:]:
+        media.append(InputMediaPhoto(media=p))
+    return media
+
+
+class RenderedLot:
+    """Готовые подписи и медиа одного лота"""
+
+    __slots__ = ("card_body", "card_key", "card_caption", "card_frames", "detail_media")
+
+    def __init__(self, item: Lot):
+        self.card_body = render_card_body(item)
+        self.card_key: tuple[int, int] | None = None
+        self.card_caption = ""
+        self.card_frames: dict[int, InputMediaPhoto] = {}
+        self.detail_media = album(item.photos, render_detail_caption(item))
+
+
+class RenderCache:
+    """Кэш отрисовки карточек по id лота.
+
+    Подключён к каталогу как индекс: добавление, изменение или удаление лота
+    сбрасывает его запись, перечитывание каталога — весь кэш. Подпись
+    карточки со строкой «Страница X из Y» пересобирается, только когда
+    меняются позиция или размер выдачи.
+    """
+
+    def __init__(self):
+        self._entries: dict[int, RenderedLot] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def rebuild(self, items):
+        self._entries.clear()
+
+    def add(self, item: Lot):
+        self._entries.pop(item.id, None)
+
+    def remove(self, item: Lot):
+        self._entries.pop(item.id, None)
+
+    def _entry(self, item: Lot) -> RenderedLot:
+        entry = self._entries.get(item.id)
+        if entry is None:
+            self.misses += 1
+            entry = self._entries[item.id] = RenderedLot(item)
+        else:
+            self.hits += 1
+        return entry
+
+    def card(self, item: Lot, page: int, total: int, photo: int = 0) -> InputMediaPhoto:
+        """Кадр галереи: одно фото лота с подписью карточки"""
+        entry = self._entry(item)
+        if entry.card_key != (page, total):
+            entry.card_caption = entry.card_body + f"📄 Страница {page + 1} из {total}"
+            entry.card_frames = {}
+            entry.card_key = (page, total)
+        frame = entry.card_frames.get(photo)
+        if frame is None:
+            frame = entry.card_frames[photo] = InputMediaPhoto(
+                media=item.photos[photo], caption=entry.card_caption, parse_mode="Markdown"
+            )
+        return frame
+
+    def detail(self, item: Lot) -> list[InputMediaPhoto]:
+        return self._entry(item).detail_media
+
+
+render_cache = RenderCache()
+catalog.subscribe(render_cache)
+
+# ========================== Список лотов =========================
+LIST_PAGE_SIZE = 15
+LIST_SORTS = {"new": "🆕 Новые", "pa": "🔼 Дешевле", "pd": "🔽 Дороже"}
+LIST_PAGES_CACHED = 512
+
+def list_key(sort: str, price: int | None, lot_id: int) -> tuple:
+    """Ключ сортировки списка; лоты без цены — в конце"""
+    if sort == "pa":
+        return (price is None, price or 0, lot_id)
+    if sort == "pd":
+        return (price is None, -(price or 0), -lot_id)
+    return (-lot_id,)
+
+
+class LotLists:
+    """Список всех лотов: отсортированные порядки и готовые страницы.
+
+    Порядки и страницы считаются один раз на версию каталога; листание
+    внутри версии — поиск в кэше. Страница задаётся ключом граничного
+    лота (цена и id), а не номером, поэтому добавленные или проданные
+    лоты не сдвигают уже показанные кнопки: листание продолжается с того
+    же места, даже если сам граничный лот удалён.
+    """
+
+    def __init__(self, store: RecordStore, page_size: int = LIST_PAGE_SIZE, limit: int = LIST_PAGES_CACHED):
+        self.store = store
+        self.page_size = page_size
+        self.limit = limit
+        self._version = None
+        self._orders: dict[str, tuple[list[tuple], list[Lot]]] = {}
+        self._pages: OrderedDict[tuple, tuple[str, InlineKeyboardMarkup]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _order(self, sort: str) -> tuple[list[tuple], list[Lot]]:
+        order = self._orders.get(sort)
+        if order is None:
+            keyed = sorted((list_key(sort, lot.price_value, lot.id), lot) for lot in self.store)
+            order = self._orders[sort] = ([key for key, _ in keyed], [lot for _, lot in keyed])
+        return order
+
+    def page(self, sort: str, direction: str, price: int | None, lot_id: int | None) -> tuple[str, InlineKeyboardMarkup]:
+        """Страница после (a) или до (b) лота с данным ключом; без ключа — первая"""
+        if self._version != self.store.version:
+            self._version = self.store.version
+            self._orders.clear()
+            self._pages.clear()
+        cache_key = (sort, direction, price, lot_id)
+        page = self._pages.get(cache_key)
+        if page is not None:
+            self.hits += 1
+            self._pages.move_to_end(cache_key)
+            return page
+        self.misses += 1
+
+        keys, lots = self._order(sort)
+        if lot_id is None:
+            start = 0
+        elif direction == "b":
+            start = max(0, bisect_left(keys, list_key(sort, price, lot_id)) - self.page_size)
+        else:
+            start = bisect_right(keys, list_key(sort, price, lot_id))
+        if start >= len(lots):
+            # Лоты в конце списка удалили — показываем последнюю страницу
+            start = max(0, len(lots) - self.page_size)
+        chunk = lots[start:start + self.page_size]
+        page = self._pages[cache_key] = self._render(sort, start, chunk, len(lots))
+        while len(self._pages) > self.limit:
+            self._pages.popitem(last=False)
+        return page
+
+    @staticmethod
+    def _render(sort: str, start: int, chunk: list[Lot], total: int) -> tuple[str, InlineKeyboardMarkup]:
+        def cursor(direction: str, lot: Lot) -> str:
+            price = "" if lot.price_value is None else lot.price_value
+            return f"ls:{sort}:{direction}:{price}:{lot.id}"
+
+        keyboard = [
+            [InlineKeyboardButton(text=f"{lot.title[:35]} | {lot.price}₽", callback_data=f"lot:{lot.id}")]
+            for lot in chunk
+        ]
+        nav = []
+        if start > 0:
+            nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=cursor("b", chunk[0])))
+        if start + len(chunk) < total:
+            nav.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=cursor("a", chunk[-1])))
+        if nav:
+            keyboard.append(nav)
+        keyboard.append([
+            InlineKeyboardButton(text=f"• {title}" if key == sort else title, callback_data=f"ls:{key}")
+            for key, title in LIST_SORTS.items()
+        ])
+        keyboard.append([InlineKeyboardButton(text="🔙 К каталогу", callback_data="catalog:0")])
+        text = (
+            f"📋 *СПИСОК ВСЕХ ЛОТОВ* ({total} шт)\n"
+            f"Лоты {start + 1}–{start + len(chunk)}\n\n"
+            "Выберите лот для просмотра:"
+        )
+        return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+lot_lists = LotLists(catalog)
+
+async def edit_menu(
+    message: types.Message,
+    text: str,
+    reply_markup: InlineKeyboardMarkup,
+    parse_mode: str | None = "Markdown",
+):
+    """Показывает меню в том же сообщении: у фото галереи меняется подпись, у текста — текст"""
+    try:
+        if message.photo:
+            await message.edit_caption(caption=text, reply_markup=reply_markup, parse_mode=parse_mode)
+        else:
+            await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return
+        await message.answer(text, reply_markup=reply_markup, parse_mode=parse_mode)
+
 # ========================== Общие команды ========================
 @dp.message(Command("start"))
 async def cmd_start(m: types.Message):
@@ -267,17 +2802,266 @@ async def cmd_del(m: types.Message):
         await m.answer("Использование: /del 7")
         return
 
-    # Перезагружаем каталог из файла
-    global catalog
-    catalog = reload_catalog()
-    
-    before = len(catalog)
-    catalog = [l for l in catalog if l["id"] != lot_id]
-    save_catalog()
-    if len(catalog) < before:
-        await m.answer(f"✅ Лот №{lot_id} удалён.")
-    else:
+    await reload_catalog()
+    item = catalog.get(lot_id)
+    if item is None:
         await m.answer("❌ Такого лота нет.")
+        return
+    # Удаляем по кнопке и только тот лот, что показан: если его успели изменить — отказ
+    await m.answer(
+        f"🗑 Удалить лот №{lot_id}?\n{item.title} · {item.price}₽ · {item.city}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"del:{lot_id}:{item.fingerprint()}"),
+        ]]),
+    )
+
+@dp.callback_query(F.data.startswith("del:"))
+async def confirm_del(call: types.CallbackQuery):
+    if call.from_user.id != ADMIN_ID:
+        await call.answer("🚫 Нет прав.", show_alert=True)
+        return
+    _, lot_id, expected = call.data.split(":")
+    lot_id = int(lot_id)
+
+    await reload_catalog()
+    try:
+        removed = catalog.remove(lot_id, event="deleted", expected=expected)
+    except ConflictError:
+        await call.answer("⚠️ Лот изменился — повторите /del", show_alert=True)
+        return
+    if removed is not None:
+        save_catalog()
+        await edit_menu(call.message, f"✅ Лот №{lot_id} удалён.", None, parse_mode=None)
+        await call.answer()
+    else:
+        await call.answer("❌ Такого лота уже нет.", show_alert=True)
+
+@dp.message(Command("reload"))
+async def cmd_reload(m: types.Message):
+    """Принудительно перечитывает каталог и заявки с диска"""
+    if m.from_user.id != ADMIN_ID:
+        return
+    # Сначала сохраняем своё: перечитывание не должно терять несохранённые изменения
+    await RecordStore.flush_together(catalog, pending)
+    reloaded = [await store.refresh(force=True) for store in (catalog, pending)]
+    if not all(reloaded):
+        await m.answer("⚠️ Не все изменения удалось сохранить — перечитаю после следующей записи.")
+        return
+    await m.answer(f"🔄 Перечитано: лотов {len(catalog)}, заявок {len(pending)}.")
+
+@dp.message(Command("stats"))
+async def cmd_stats(m: types.Message):
+    """Состояние очереди исходящих запросов и кэшей"""
+    if m.from_user.id != ADMIN_ID:
+        return
+    s = send_scheduler.stats()
+    await m.answer(
+        "📊 *Статистика*\n\n"
+        f"Лотов: {len(catalog)}, заявок: {len(pending)}\n"
+        f"Запросов к API: {s['requests']}\n"
+        f"В очереди: {s['queue_depth']}\n"
+        f"Задержано лимитом: {s['throttled']} "
+        f"(в среднем {s['throttle_delay_avg']:.2f} с, макс. {s['throttle_delay_max']:.2f} с)\n"
+        f"Ответов 429: {s['retry_after']}, потеряно: {s['dropped']}\n"
+        f"Кэш карточек: {render_cache.hits} попаданий / {render_cache.misses} промахов\n"
+        f"Кэш списка лотов: {lot_lists.hits} попаданий / {lot_lists.misses} промахов",
+        parse_mode="Markdown",
+    )
+
+# ========================== Экспорт / импорт =====================
+EXPORT_FIELDS = ("id", "title", "year", "condition", "size", "city", "price", "comment", "owner_id", "photos")
+EXPORT_CHUNK = 1000
+IMPORT_BATCH = 500
+PROGRESS_INTERVAL = 2.0
+IMPORT_ERRORS_SHOWN = 10
+
+
+class Progress:
+    """Ход долгой операции в одном сообщении: правка не чаще раза в interval секунд"""
+
+    def __init__(self, message: types.Message, interval: float = PROGRESS_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._text = message.text
+        self._at = time.monotonic()
+
+    @classmethod
+    async def start(cls, m: types.Message, text: str) -> "Progress":
+        return cls(await m.answer(text))
+
+    async def update(self, text: str, force: bool = False):
+        now = time.monotonic()
+        if text == self._text or (not force and now - self._at < self.interval):
+            return
+        self._text, self._at = text, now
+        try:
+            await self.message.edit_text(text)
+        except TelegramBadRequest as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе операции: {e}")
+
+
+def export_record(lot: Lot) -> dict:
+    # Числовые цена и год — производные, при импорте они считаются заново
+    data = lot.to_dict()
+    del data["price_value"], data["year_value"]
+    return data
+
+def write_export_chunk(f, lots: list[Lot], fmt: str):
+    if fmt == "csv":
+        csv.writer(f).writerows(
+            [lot.id, lot.title, lot.year, lot.condition, lot.size, lot.city, lot.price, lot.comment,
+             "" if lot.owner_id is None else lot.owner_id, " ".join(lot.photos)]
+            for lot in lots
+        )
+    else:
+        f.writelines(json.dumps(export_record(lot), ensure_ascii=False) + "\n" for lot in lots)
+
+def iter_import_rows(f, fmt: str):
+    """Строки файла импорта по одной: (номер строки, сырая запись или текст ошибки)"""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Пустые ячейки — отсутствующие поля; фото через пробел
+            raw = {k: v for k, v in row.items() if k is not None and v not in ("", None)}
+            if "photos" in raw:
+                raw["photos"] = raw["photos"].split()
+            yield reader.line_num, raw
+        return
+    for line_no, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, f"не JSON: {e}"
+
+
+class ImportReport:
+    """Счётчики импорта и первые ошибки (все ошибки в памяти не держим)"""
+
+    def __init__(self):
+        self.rows = 0
+        self.added = 0
+        self.updated = 0
+        self.errors = 0
+        self.samples: list[str] = []
+
+    def fail(self, line_no: int, error: str):
+        self.errors += 1
+        if len(self.samples) < IMPORT_ERRORS_SHOWN:
+            self.samples.append(f"строка {line_no}: {error}")
+
+    def text(self, title: str) -> str:
+        text = (
+            f"{title}\n\nСтрок: {self.rows}\nДобавлено: {self.added}\n"
+            f"Обновлено: {self.updated}\nОшибок: {self.errors}"
+        )
+        if self.samples:
+            text += "\n\n" + "\n".join(self.samples)
+        return text
+
+
+async def import_batch(batch: list[tuple[int, object]], report: ImportReport):
+    """Проверяет пачку строк и применяет её одной записью в хранилище"""
+    report.rows += len(batch)
+    raws = []
+    for line_no, raw in batch:
+        if isinstance(raw, str):
+            report.fail(line_no, raw)
+        elif not isinstance(raw, dict):
+            report.fail(line_no, "ожидался объект")
+        else:
+            raw.pop("price_value", None)
+            raw.pop("year_value", None)
+            raws.append((line_no, raw))
+    # Строкам без id выдаются новые номера (неиспользованные просто пропадут)
+    missing = [raw for _, raw in raws if raw.get("id") is None]
+    for raw, lot_id in zip(missing, await lot_seq.take(len(missing)) if missing else []):
+        raw["id"] = lot_id
+    lots = []
+    for line_no, raw in raws:
+        try:
+            lots.append(Lot.decode(raw))
+        except RecordError as e:
+            report.fail(line_no, str(e))
+    if not lots:
+        return
+    await lot_seq.skip_to(max(lot.id for lot in lots))
+    async with catalog.locked(*(lot.id for lot in lots)):
+        await reload_catalog()
+        for lot in lots:
+            if catalog.put(lot, event="imported"):
+                report.updated += 1
+            else:
+                report.added += 1
+        catalog.save()
+        await catalog.flush()
+
+@dp.message(Command("export"))
+async def cmd_export(m: types.Message):
+    """Выгрузка каталога файлом: /export [ndjson|csv]"""
+    if m.from_user.id != ADMIN_ID:
+        return
+    fmt = (m.text.split()[1:] or ["ndjson"])[0].lower()
+    if fmt not in ("ndjson", "csv"):
+        await m.answer("Использование: /export [ndjson|csv]")
+        return
+
+    await reload_catalog()
+    # Только ссылки на лоты: текст выгрузки пишется в файл по частям
+    lots = list(catalog)
+    progress = await Progress.start(m, f"📤 Экспорт: 0 из {len(lots)}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / f"catalog-{date.today():%Y%m%d}.{fmt}"
+        with open(path, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as f:
+            if fmt == "csv":
+                csv.writer(f).writerow(EXPORT_FIELDS)
+            for start in range(0, len(lots), EXPORT_CHUNK):
+                await asyncio.to_thread(write_export_chunk, f, lots[start:start + EXPORT_CHUNK], fmt)
+                await progress.update(f"📤 Экспорт: {min(start + EXPORT_CHUNK, len(lots))} из {len(lots)}")
+        await progress.update(f"📤 Экспорт: {len(lots)} лотов, отправляю файл…", force=True)
+        await m.answer_document(FSInputFile(path), caption=f"Каталог: {len(lots)} лотов")
+    await progress.update(f"✅ Экспорт готов: {len(lots)} лотов", force=True)
+
+@dp.message(Command("import"))
+async def cmd_import(m: types.Message):
+    """Загрузка лотов из файла .ndjson или .csv: подпись /import или ответ /import на файл.
+
+    Лоты с существующим id заменяются, без id — добавляются с новым номером.
+    """
+    if m.from_user.id != ADMIN_ID:
+        return
+    document = m.document or (m.reply_to_message.document if m.reply_to_message else None)
+    if document is None:
+        await m.answer(
+            "Использование: отправьте файл .ndjson или .csv с подписью /import "
+            "или ответьте /import на сообщение с файлом.\n"
+            f"Колонки CSV: {', '.join(EXPORT_FIELDS)} (фото — через пробел)."
+        )
+        return
+    fmt = "csv" if (document.file_name or "").lower().endswith(".csv") else "ndjson"
+
+    progress = await Progress.start(m, "📥 Импорт: загружаю файл…")
+    report = ImportReport()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "import"
+        try:
+            await bot.download(document, destination=path, timeout=120)
+        except TelegramAPIError as e:
+            await progress.update(f"❌ Не удалось скачать файл: {e}", force=True)
+            return
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                rows = iter_import_rows(f, fmt)
+                # Чтение и разбор — в потоке, пачками; в памяти не больше одной пачки
+                while batch := await asyncio.to_thread(lambda: list(islice(rows, IMPORT_BATCH))):
+                    await import_batch(batch, report)
+                    await progress.update(report.text("📥 Импорт…"))
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Применённые пачки остаются: повторный импорт того же файла их просто обновит
+            await progress.update(report.text(f"❌ Импорт прерван, файл не читается: {e}"), force=True)
+            return
+    await progress.update(report.text("✅ Импорт завершён"), force=True)
 
 # ========================== Продать вещь =========================
 @dp.message(F.text == "🛒 Продать вещь")
@@ -296,61 +3080,132 @@ async def user_sell(m: types.Message, state: FSMContext):
     )
 
 # ----- загрузка фото -----
+MAX_PHOTOS = 10
+
+async def update_photo_status(chat_id: int, count: int, status_msg_id: int | None, ignored: int = 0) -> int | None:
+    """Обновляет (или создаёт) сообщение со счётчиком фото, возвращает его id"""
+    status_text = f"📸 Фото прикреплены\n📊 Всего: *{count}/{MAX_PHOTOS}*\n\n"
+    if ignored:
+        status_text += f"⚠️ Не добавлено фото сверх лимита: {ignored}. Нажмите «✅ Далее»"
+    else:
+        status_text += "Можно добавить ещё или нажать «✅ Далее»"
+    if status_msg_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=status_msg_id,
+                text=status_text,
+                reply_markup=photos_kb,
+                parse_mode="Markdown",
+            )
+            return status_msg_id
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return status_msg_id
+    try:
+        msg = await bot.send_message(chat_id, status_text, reply_markup=photos_kb, parse_mode="Markdown")
+        return msg.message_id
+    except Exception as e:
+        logger.exception(f"Ошибка отправки статуса фото: {e}")
+        return status_msg_id
+
+
+class AlbumBuffer:
+    """Фото одного альбома, пришедшие до срабатывания таймера"""
+
+    __slots__ = ("chat_id", "state", "photos", "timer")
+
+    def __init__(self, chat_id: int, state: FSMContext):
+        self.chat_id = chat_id
+        self.state = state
+        self.photos: list[tuple[int, str]] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MediaGroupCollector:
+    """Собирает альбомы по media_group_id.
+
+    Каждое фото лишь попадает в буфер и перезапускает единственный таймер
+    альбома; по таймеру альбом целиком записывается в состояние одной
+    операцией и статус обновляется одним сообщением. Задачи хранятся здесь,
+    чтобы их не собрал сборщик мусора, а изменения фото в одном чате
+    сериализуются блокировкой.
+    """
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self._groups: dict[str, AlbumBuffer] = {}
+        self._tasks: dict[asyncio.Task, int] = {}
+        self._locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        return lock
+
+    def add(self, m: types.Message, state: FSMContext):
+        group = self._groups.get(m.media_group_id)
+        if group is None:
+            group = self._groups[m.media_group_id] = AlbumBuffer(m.chat.id, state)
+        group.photos.append((m.message_id, m.photo[-1].file_id))
+        if group.timer is not None:
+            group.timer.cancel()
+        group.timer = asyncio.get_running_loop().call_later(self.delay, self._fire, m.media_group_id)
+
+    def _fire(self, group_id: str):
+        group = self._groups.pop(group_id, None)
+        if group is None:
+            return
+        task = asyncio.create_task(self._commit(group))
+        self._tasks[task] = group.chat_id
+        task.add_done_callback(self._tasks.pop)
+
+    async def _commit(self, group: AlbumBuffer):
+        async with self.lock(group.chat_id):
+            if await group.state.get_state() != Form.photos.state:
+                return
+            data = await group.state.get_data()
+            photos = list(data.get("photos", []))
+            ignored = 0
+            # Порядок альбома — по message_id
+            for _, file_id in sorted(group.photos):
+                if file_id in photos:
+                    continue
+                if len(photos) < MAX_PHOTOS:
+                    photos.append(file_id)
+                else:
+                    ignored += 1
+            status_msg_id = await update_photo_status(group.chat_id, len(photos), data.get("status_msg_id"), ignored)
+            await group.state.update_data(photos=photos, status_msg_id=status_msg_id)
+
+    async def flush_chat(self, chat_id: int):
+        """Досрочно записывает все альбомы чата (перед переходом к следующему шагу)"""
+        for group_id in [gid for gid, g in self._groups.items() if g.chat_id == chat_id]:
+            group = self._groups.pop(group_id)
+            group.timer.cancel()
+            await self._commit(group)
+        running = [task for task, chat in self._tasks.items() if chat == chat_id]
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+media_groups = MediaGroupCollector()
+
 @dp.message(Form.photos, F.photo)
 async def handle_photos(m: types.Message, state: FSMContext):
-    data = await state.get_data()
-    photos = data.get("photos", [])
-    status_msg_id = data.get("status_msg_id")
-    
-    # Обработка альбома или одного фото
+    # Альбом копится в памяти и записывается целиком по таймеру
     if m.media_group_id:
-        # Альбом - сохраняем все фото с порядком по message_id
-        if "media_groups" not in data:
-            data["media_groups"] = {}
-        if m.media_group_id not in data["media_groups"]:
-            data["media_groups"][m.media_group_id] = []
-        data["media_groups"][m.media_group_id].append({
-            "file_id": m.photo[-1].file_id,
-            "message_id": m.message_id
-        })
-        await state.update_data(**data)
-        
-        # Обновляем статус после небольшой задержки, чтобы собрать все фото из альбома
-        async def update_status_after_delay():
-            await asyncio.sleep(1)  # Ждем 1 секунду для сбора всех фото из альбома
-            data = await state.get_data()
-            media_groups = data.get("media_groups", {})
-            if m.media_group_id in media_groups:
-                group_photos = media_groups[m.media_group_id]
-                # Сортируем по message_id для правильного порядка
-                sorted_group = sorted(group_photos, key=lambda x: x["message_id"])
-                current_photos = data.get("photos", [])
-                for p in sorted_group:
-                    if p["file_id"] not in current_photos and len(current_photos) < 10:
-                        current_photos.append(p["file_id"])
-                await state.update_data(photos=current_photos)
-                
-                # Обновляем статусное сообщение
-                status_msg_id = data.get("status_msg_id")
-                status_text = f"📸 Фото прикреплены\n📊 Всего: *{len(current_photos)}/10*\n\nМожно добавить ещё или нажать «✅ Далее»"
-                if status_msg_id:
-                    try:
-                        await bot.edit_message_text(
-                            chat_id=m.chat.id,
-                            message_id=status_msg_id,
-                            text=status_text,
-                            reply_markup=photos_kb,
-                            parse_mode="Markdown",
-                        )
-                    except:
-                        pass
-        
-        # Запускаем обновление статуса
-        asyncio.create_task(update_status_after_delay())
+        media_groups.add(m, state)
         return
-    else:
-        # Одно фото - добавляем сразу
-        if len(photos) >= 10:
+    
+    # Одно фото - добавляем сразу
+    async with media_groups.lock(m.chat.id):
+        data = await state.get_data()
+        photos = data.get("photos", [])
+        status_msg_id = data.get("status_msg_id")
+        
+        if len(photos) >= MAX_PHOTOS:
             if status_msg_id:
                 try:
                     await bot.edit_message_text(
@@ -359,33 +3214,15 @@ async def handle_photos(m: types.Message, state: FSMContext):
                         text="⚠️ Максимум 10 фото! Нажмите «✅ Далее»",
                         reply_markup=photos_kb,
                     )
-                except:
+                except TelegramBadRequest:
                     pass
             else:
                 await m.answer("⚠️ Максимум 10 фото! Нажмите «✅ Далее»", reply_markup=photos_kb)
             return
         
         photos.append(m.photo[-1].file_id)
-        await state.update_data(photos=photos)
-    
-    # Обновляем или создаем статусное сообщение
-    status_text = f"📸 Фото прикреплены\n📊 Всего: *{len(photos)}/10*\n\nМожно добавить ещё или нажать «✅ Далее»"
-    
-    if status_msg_id:
-        try:
-            await bot.edit_message_text(
-                chat_id=m.chat.id,
-                message_id=status_msg_id,
-                text=status_text,
-                reply_markup=photos_kb,
-                parse_mode="Markdown",
-            )
-        except:
-            msg = await m.answer(status_text, reply_markup=photos_kb, parse_mode="Markdown")
-            await state.update_data(status_msg_id=msg.message_id)
-    else:
-        msg = await m.answer(status_text, reply_markup=photos_kb, parse_mode="Markdown")
-        await state.update_data(status_msg_id=msg.message_id)
+        status_msg_id = await update_photo_status(m.chat.id, len(photos), status_msg_id)
+        await state.update_data(photos=photos, status_msg_id=status_msg_id)
 
 @dp.message(Form.photos, F.text == "➕ Добавить ещё фото")
 async def photos_more(m: types.Message, state: FSMContext):
@@ -393,21 +3230,11 @@ async def photos_more(m: types.Message, state: FSMContext):
 
 @dp.message(Form.photos, F.text == "✅ Далее")
 async def photos_next(m: types.Message, state: FSMContext):
+    # Альбом мог ещё не дособраться — записываем его сейчас
+    await media_groups.flush_chat(m.chat.id)
     data = await state.get_data()
     photos = data.get("photos", [])
     
-    # Обрабатываем медиа-группы если есть
-    if "media_groups" in data:
-        for group_id, group_photos in data["media_groups"].items():
-            # Сортируем по message_id (они идут по порядку) и добавляем в правильном порядке
-            sorted_photos = sorted(group_photos, key=lambda x: x["message_id"])
-            for p in sorted_photos:
-                if p["file_id"] not in photos and len(photos) < 10:
-                    photos.append(p["file_id"])
-        await state.update_data(photos=photos)
-        data = await state.get_data()
-        photos = data.get("photos", [])
-    
     if not photos:
         await m.answer("❌ Нужно хотя бы одно фото!", reply_markup=photos_kb)
         return
@@ -422,7 +3249,7 @@ async def photos_next(m: types.Message, state: FSMContext):
     
     # Убираем промежуточное подтверждение, сразу переходим к названию
     await state.set_state(Form.title)
-    await state.update_data(status_msg_id=None, media_groups=None)
+    await state.update_data(status_msg_id=None)
     await m.answer("✏️ Напишите название вещи", reply_markup=cancel_kb)
 
 
@@ -509,22 +3336,22 @@ async def comment_fix(m: types.Message, state: FSMContext):
 @dp.message(Form.comment_confirm, F.text == "✅ Одобрить")
 async def comment_ok(m: types.Message, state: FSMContext):
     data = await state.get_data()
-    global pending
-    pending_id = len(pending) + 1
-    request_item = {
-        "pending_id": pending_id,
-        "owner_id": data["owner_id"],
-        "owner_username": data["owner_username"],
-        "photos": data["photos"],
-        "title": data["title"],
-        "year": data["year"],
-        "condition": data["condition"],
-        "size": data["size"],
-        "price": data["price"],
-        "city": data["city"],
-        "comment": data["comment"],
-    }
-    pending.append(request_item)
+    pending_id = await pending_seq.next()
+    await reload_pending()
+    request_item = PendingItem(
+        pending_id=pending_id,
+        owner_id=data["owner_id"],
+        owner_username=data["owner_username"],
+        photos=data["photos"],
+        title=data["title"],
+        year=data["year"],
+        condition=data["condition"],
+        size=data["size"],
+        price=data["price"],
+        city=data["city"],
+        comment=data["comment"],
+    )
+    pending.add(request_item, event="submitted")
     save_pending()
     await state.clear()
 
@@ -534,17 +3361,17 @@ async def comment_ok(m: types.Message, state: FSMContext):
     # Отправка админу
     caption = (
         f"🆕 НОВАЯ ЗАЯВКА #{pending_id}\n\n"
-        f"Название: *{request_item['title']}*\n"
-        f"Год/возраст: {request_item['year']}\n"
-        f"Состояние: {request_item['condition']}\n"
-        f"Размер: {request_item['size']}\n"
-        f"Цена: {request_item['price']} ₽\n"
-        f"Город: {request_item['city']}\n"
-        f"Комментарий: {request_item['comment']}\n\n"
-        f"👤 @{request_item['owner_username']} (ID: {request_item['owner_id']})"
+        f"Название: *{request_item.title}*\n"
+        f"Год/возраст: {request_item.year}\n"
+        f"Состояние: {request_item.condition}\n"
+        f"Размер: {request_item.size}\n"
+        f"Цена: {request_item.price} ₽\n"
+        f"Город: {request_item.city}\n"
+        f"Комментарий: {request_item.comment}\n\n"
+        f"👤 @{request_item.owner_username} (ID: {request_item.owner_id})"
     )
-    media = [InputMediaPhoto(media=request_item["photos"][0], caption=caption, parse_mode="Markdown")]
-    for p in request_item["photos"][1:]:
+    media = [InputMediaPhoto(media=request_item.photos[0], caption=caption, parse_mode="Markdown")]
+    for p in request_item.photos[1:]:
         media.append(InputMediaPhoto(media=p))
     
     msgs = await bot.send_media_group(chat_id=ADMIN_ID, media=media)
@@ -554,144 +3381,266 @@ async def comment_ok(m: types.Message, state: FSMContext):
     )
 
 # ========================== Апрув / отклонение ===================
-@dp.callback_query(F.data.startswith("approve:"))
-async def cb_approve(call: types.CallbackQuery):
-    if call.from_user.id != ADMIN_ID:
-        await call.answer("🚫 Нет прав.", show_alert=True)
-        return
+async def fan_out(*coros, limit: int | None = None) -> list[bool]:
+    """Выполняет побочные действия параллельно; сбой одного не мешает остальным.
 
-    # Перезагружаем данные из файлов
-    global pending, catalog
-    pending = reload_pending()
-    catalog = reload_catalog()
-    
-    pending_id = int(call.data.split(":")[1])
-    item = next((x for x in pending if x["pending_id"] == pending_id), None)
-    if not item:
-        await call.answer("❌ Заявка не найдена.", show_alert=True)
-        return
+    Возвращает список признаков успеха в порядке аргументов. limit ограничивает
+    число одновременно выполняемых вызовов.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
 
-    lot_id = next_lot_id()
-    lot = {
-        "id": lot_id,
-        "photos": item["photos"],
-        "title": item["title"],
-        "year": item["year"],
-        "condition": item["condition"],
-        "size": item["size"],
-        "price": item["price"],
-        "city": item["city"],
-        "comment": item["comment"],
-        "owner_id": item["owner_id"],
-    }
-    catalog.append(lot)
-    save_catalog()
+    async def run(coro):
+        if semaphore is None:
+            return await coro
+        async with semaphore:
+            return await coro
 
-    pending = [x for x in pending if x["pending_id"] != pending_id]
-    save_pending()
+    results = await asyncio.gather(*(run(c) for c in coros), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Побочное действие модерации не выполнено: {result}")
+    return [not isinstance(result, Exception) for result in results]
+
+
+async def finish_moderation(message: types.Message, status: str, notification, pending_id: int):
+    """Статус в сообщении модерации и уведомление владельца — параллельно.
+
+    Статус не ждёт доставки; если владелец недоступен, админ получает
+    отдельную заметку.
+    """
+    _, delivered = await fan_out(set_moderation_status(message, status), notification)
+    if not delivered:
+        await message.answer(f"⚠️ Не удалось уведомить владельца заявки #{pending_id}")
 
-    # Обновляем сообщение админу
+
+async def set_moderation_status(message: types.Message, status: str):
+    """Одно итоговое обновление сообщения модерации: статус вместо кнопок"""
     try:
-        if call.message.caption:
-            new_caption = call.message.caption + f"\n\n✅ *ОПУБЛИКОВАНО* как лот №{lot_id}"
-            await call.message.edit_caption(
-                caption=new_caption,
+        if message.caption:
+            await message.edit_caption(
+                caption=message.caption + f"\n\n{status}",
                 parse_mode="Markdown",
                 reply_markup=None,
             )
         else:
-            await call.message.edit_text(
-                text=call.message.text + f"\n\n✅ *ОПУБЛИКОВАНО* как лот №{lot_id}",
+            await message.edit_text(
+                text=message.text + f"\n\n{status}",
                 parse_mode="Markdown",
                 reply_markup=None,
             )
     except Exception as e:
         logger.exception(f"Ошибка обновления сообщения: {e}")
-    
-    await call.answer("✅ Опубликовано!")
 
-    # Уведомление юзеру
-    try:
-        await bot.send_message(
-            item["owner_id"],
-            f"🎉 Ваша заявка *одобрена*!\n\n"
-            f"🆔 Лот №{lot_id} опубликован в каталоге!",
-            parse_mode="Markdown",
-        )
-    except Exception as e:
-        logger.exception(f"Не удалось уведомить владельца: {e}")
-    
-    # Уведомление админу
+def lot_from_pending(item: PendingItem, lot_id: int) -> Lot:
+    return Lot(
+        id=lot_id,
+        photos=item.photos,
+        title=item.title,
+        year=item.year,
+        condition=item.condition,
+        size=item.size,
+        price=item.price,
+        city=item.city,
+        comment=item.comment,
+        owner_id=item.owner_id,
+        price_value=item.price_value,
+        year_value=item.year_value,
+    )
+
+
+def notify_approved(item: PendingItem, lot_id: int):
+    return bot.send_message(
+        item.owner_id,
+        f"🎉 Ваша заявка *одобрена*!\n\n"
+        f"🆔 Лот №{lot_id} опубликован в каталоге!",
+        parse_mode="Markdown",
+    )
+
+
+def notify_rejected(item: PendingItem):
+    return bot.send_message(
+        item.owner_id,
+        "😔 К сожалению, ваша заявка отклонена модератором.",
+    )
+
+@dp.callback_query(F.data.startswith("approve:"))
+async def cb_approve(call: types.CallbackQuery):
+    if call.from_user.id != ADMIN_ID:
+        await call.answer("🚫 Нет прав.", show_alert=True)
+        return
+
+    # Отвечаем сразу: кнопка у админа не «крутится», пока ждём блокировку и хранилище
+    await call.answer("⏳ Публикую…")
+    pending_id = int(call.data.split(":")[1])
+    # Повторный клик или /queue ждут, пока эта заявка не будет обработана
+    async with pending.locked(pending_id):
+        await reload_pending()
+        await reload_catalog()
+
+        item = pending.get(pending_id)
+        if not item:
+            await call.message.answer(f"❌ Заявка #{pending_id} не найдена (уже обработана?).")
+            return
+
+        # Номер берём только для существующей заявки: повторный клик его не тратит
+        lot_id = await next_lot_id()
+        catalog.add(lot_from_pending(item, lot_id), event="approved")
+        save_catalog()
+
+        pending.remove(pending_id, event="approved")
+        save_pending()
+
+    await finish_moderation(
+        call.message, f"✅ *ОПУБЛИКОВАНО* как лот №{lot_id}", notify_approved(item, lot_id), pending_id,
+    )
+
+@dp.callback_query(F.data.startswith("reject:"))
+async def cb_reject(call: types.CallbackQuery):
+    if call.from_user.id != ADMIN_ID:
+        await call.answer("🚫 Нет прав.", show_alert=True)
+        return
+
+    await call.answer("⏳ Отклоняю…")
+    pending_id = int(call.data.split(":")[1])
+    async with pending.locked(pending_id):
+        await reload_pending()
+        item = pending.remove(pending_id, event="rejected")
+        if not item:
+            await call.message.answer(f"❌ Заявка #{pending_id} не найдена (уже обработана?).")
+            return
+        save_pending()
+
+    await finish_moderation(call.message, "❌ *ОТКЛОНЕНО*", notify_rejected(item), pending_id)
+
+# ----- пакетная модерация (/queue) -----
+QUEUE_PAGE_SIZE = 8
+NOTIFY_CONCURRENCY = 8
+
+def queue_view(page: int, selected: set[int]) -> tuple[str, InlineKeyboardMarkup]:
+    """Компактный список заявок с отметками выбора (без Markdown: в заявках текст пользователей)"""
+    items = list(pending)
+    pages = max(1, (len(items) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    chunk = items[page * QUEUE_PAGE_SIZE:(page + 1) * QUEUE_PAGE_SIZE]
+
+    lines = [f"📋 Очередь заявок: {len(items)}, выбрано: {len(selected)}", ""]
+    lines += [f"#{x.pending_id} · {x.title} · {x.price} · {x.city}" for x in chunk]
+    if not items:
+        lines.append("Очередь пуста 🎉")
+
+    rows = [
+        [InlineKeyboardButton(
+            text=f"{'☑️' if x.pending_id in selected else '⬜'} #{x.pending_id} {x.title[:24]}",
+            callback_data=f"q:t:{page}:{x.pending_id}",
+        )]
+        for x in chunk
+    ]
+    if pages > 1:
+        rows.append([
+            InlineKeyboardButton(text="⬅️", callback_data=f"q:p:{(page - 1) % pages}"),
+            InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"q:p:{page}"),
+            InlineKeyboardButton(text="➡️", callback_data=f"q:p:{(page + 1) % pages}"),
+        ])
+    if items:
+        rows.append([
+            InlineKeyboardButton(text="☑️ Вся страница", callback_data=f"q:a:{page}"),
+            InlineKeyboardButton(text="🧹 Сбросить", callback_data=f"q:c:{page}"),
+        ])
+        rows.append([
+            InlineKeyboardButton(text=f"✅ Одобрить ({len(selected)})", callback_data=f"q:ok:{page}"),
+            InlineKeyboardButton(text=f"❌ Отклонить ({len(selected)})", callback_data=f"q:no:{page}"),
+        ])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def moderate_batch(pending_ids: list[int], approve: bool) -> str:
+    """Одобряет/отклоняет пачку заявок одной записью в хранилище, затем рассылает уведомления"""
+    async with pending.locked(*pending_ids):
+        await reload_pending()
+        await reload_catalog()
+        items = [item for pending_id in pending_ids if (item := pending.get(pending_id))]
+        # Номера — только для заявок, которые ещё ждут модерации
+        new_ids = await lot_seq.take(len(items)) if approve and items else []
+
+        notifications = []
+        if approve:
+            for item, lot_id in zip(items, new_ids):
+                catalog.add(lot_from_pending(item, lot_id), event="approved")
+                notifications.append(notify_approved(item, lot_id))
+            save_catalog()
+        else:
+            notifications = [notify_rejected(item) for item in items]
+        pending.remove_many([item.pending_id for item in items], event="approved" if approve else "rejected")
+        save_pending()
+        await RecordStore.flush_together(catalog, pending)
+
+    # Уведомления не должны отнимать лимит у живых пользователей
+    token = send_priority.set(PRIORITY_BACKGROUND)
     try:
-        await bot.send_message(
-            ADMIN_ID,
-            f"✅ Заявка #{pending_id} одобрена и опубликована как лот №{lot_id}",
-        )
-    except Exception as e:
-        logger.exception(f"Ошибка отправки уведомления админу: {e}")
+        delivered = await fan_out(*notifications, limit=NOTIFY_CONCURRENCY)
+    finally:
+        send_priority.reset(token)
 
-@dp.callback_query(F.data.startswith("reject:"))
-async def cb_reject(call: types.CallbackQuery):
-    if call.from_user.id != ADMIN_ID:
-        await call.answer("🚫 Нет прав.", show_alert=True)
+    verb = "✅ Одобрено" if approve else "❌ Отклонено"
+    summary = f"{verb}: {len(items)}, владельцев уведомлено: {sum(delivered)}/{len(items)}"
+    if len(items) < len(pending_ids):
+        summary += f"\n⚠️ Уже обработаны ранее: {len(pending_ids) - len(items)}"
+    return summary
+
+
+@dp.message(Command("queue"))
+async def cmd_queue(m: types.Message, state: FSMContext):
+    """Очередь заявок с множественным выбором"""
+    if m.from_user.id != ADMIN_ID:
         return
+    await reload_pending()
+    await state.update_data(queue_selected=[])
+    text, kb = queue_view(0, set())
+    await m.answer(text, reply_markup=kb, parse_mode=None)
 
-    # Перезагружаем данные из файла
-    global pending
-    pending = reload_pending()
-    
-    pending_id = int(call.data.split(":")[1])
-    item = next((x for x in pending if x["pending_id"] == pending_id), None)
-    if not item:
-        await call.answer("❌ Заявка не найдена.", show_alert=True)
+@dp.callback_query(F.data.startswith("q:"))
+async def cb_queue(call: types.CallbackQuery, state: FSMContext):
+    if call.from_user.id != ADMIN_ID:
+        await call.answer("🚫 Нет прав.", show_alert=True)
         return
 
-    pending = [x for x in pending if x["pending_id"] != pending_id]
-    save_pending()
+    _, action, page, *rest = call.data.split(":")
+    page = int(page)
+    await reload_pending()
+    data = await state.get_data()
+    # Заявки, обработанные где-то ещё, из выбора выпадают
+    selected = {pending_id for pending_id in data.get("queue_selected", []) if pending.get(pending_id)}
+    summary = None
 
-    # Обновляем сообщение админу
-    try:
-        if call.message.caption:
-            new_caption = call.message.caption + "\n\n❌ *ОТКЛОНЕНО*"
-            await call.message.edit_caption(
-                caption=new_caption,
-                parse_mode="Markdown",
-                reply_markup=None,
-            )
-        else:
-            await call.message.edit_text(
-                text=call.message.text + "\n\n❌ *ОТКЛОНЕНО*",
-                parse_mode="Markdown",
-                reply_markup=None,
-            )
-    except Exception as e:
-        logger.exception(f"Ошибка обновления сообщения: {e}")
-    
-    await call.answer("❌ Отклонено")
+    if action == "t":
+        pending_id = int(rest[0])
+        if pending.get(pending_id):
+            selected ^= {pending_id}
+    elif action == "a":
+        chunk = list(pending)[page * QUEUE_PAGE_SIZE:(page + 1) * QUEUE_PAGE_SIZE]
+        selected |= {x.pending_id for x in chunk}
+    elif action == "c":
+        selected.clear()
+    elif action in ("ok", "no"):
+        if not selected:
+            await call.answer("Ничего не выбрано")
+            return
+        await call.answer(f"⏳ Обрабатываю заявок: {len(selected)}")
+        summary = await moderate_batch(sorted(selected), approve=action == "ok")
+        selected.clear()
 
-    # Уведомление юзеру
-    try:
-        await bot.send_message(
-            item["owner_id"],
-            "😔 К сожалению, ваша заявка отклонена модератором.",
-        )
-    except Exception as e:
-        logger.exception(f"Не удалось уведомить владельца: {e}")
-    
-    # Уведомление админу
-    try:
-        await bot.send_message(
-            ADMIN_ID,
-            f"❌ Заявка #{pending_id} отклонена",
-        )
-    except Exception as e:
-        logger.exception(f"Ошибка отправки уведомления админу: {e}")
+    await state.update_data(queue_selected=sorted(selected))
+    if summary is None:
+        await call.answer()
+    text, kb = queue_view(page, selected)
+    if summary:
+        text = f"{summary}\n\n{text}"
+    await edit_menu(call.message, text, kb, parse_mode=None)
 
 # ========================== Каталог ==============================
 @dp.message(F.text == "📦 Актуальные лоты")
 async def user_catalog(m: types.Message):
-    # Перезагружаем каталог из файла
-    reload_catalog()
+    await reload_catalog()
     
     if not catalog:
         await m.answer("📭 Сейчас лотов нет.\n\nОбновите позже!", reply_markup=main_kb)
@@ -700,81 +3649,87 @@ async def user_catalog(m: types.Message):
     # Показываем первый лот как карточку
     await show_catalog_page(m.chat.id, 0)
 
-async def show_catalog_page(chat_id: int, page: int):
-    """Показывает страницу каталога с лотом"""
-    # Перезагружаем каталог из файла перед показом
-    global catalog
-    catalog = reload_catalog()
+async def show_catalog_page(
+    chat_id: int,
+    page: int,
+    cursor: ResultCursor | None = None,
+    message: types.Message | None = None,
+    photo: int = 0,
+):
+    """Показывает страницу каталога с лотом (или страницу выдачи курсора).
+
+    Галерея — одно сообщение-фото с подписью и кнопками. Если передано
+    сообщение галереи, оно редактируется на месте одним вызовом API вместо
+    удаления и отправки альбома; альбом остаётся только у детального
+    просмотра лота.
+    """
+    await reload_catalog()
     
-    if not catalog or page < 0 or page >= len(catalog):
+    total = len(catalog) if cursor is None else len(cursor.ids)
+    if not total or page < 0 or page >= total:
         return
     
-    item = catalog[page]
+    item = catalog[page] if cursor is None else catalog.get(cursor.ids[page])
+    if item is None:
+        return
     
-    # Формируем красивое описание карточки
-    caption = (
-        f"📦 *ВИНТАЖНАЯ ГАЛЕРЕЯ*\n\n"
-        f"━━━━━━━━━━━━━━━━━━━━\n"
-        f"*{item['title'].upper()}*\n"
-        f"━━━━━━━━━━━━━━━━━━━━\n\n"
-        f"📅 {item['year']}\n"
-        f"⭐ {item['condition']}\n"
-        f"📏 {item['size']}\n"
-        f"📍 {item['city']}\n\n"
-        f"💰 *{item['price']} ₽*\n\n"
+    photo = min(max(photo, 0), len(item.photos) - 1)
+    media = render_cache.card(item, page, total, photo)
+    keyboard = catalog_menu_kb(
+        page=page,
+        total=total,
+        lot_id=item.id,
+        cursor=cursor.rid if cursor else None,
+        photo=photo,
+        photos=len(item.photos),
     )
     
-    if item.get('comment') and item['comment'] != '-':
-        caption += f"💬 {item['comment']}\n\n"
-    
-    caption += f"📄 Страница {page + 1} из {len(catalog)}"
+    if message is not None and message.photo:
+        try:
+            await message.edit_media(media=media, reply_markup=keyboard)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            logger.warning(f"Не удалось обновить галерею, отправляю заново: {e}")
+    if message is not None:
+        try:
+            await message.delete()
+        except:
+            pass
     
     # Отправляем фото с описанием
     try:
-        media = [InputMediaPhoto(media=item["photos"][0], caption=caption, parse_mode="Markdown")]
-        for p in item["photos"][1:]:
-            media.append(InputMediaPhoto(media=p))
-        
-        msgs = await bot.send_media_group(chat_id=chat_id, media=media)
-        await msgs[-1].reply(
-            "👇 Выберите действие:",
-            reply_markup=catalog_menu_kb(page=page)
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=media.media,
+            caption=media.caption,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
         )
     except Exception as e:
         logger.exception(f"Ошибка отправки карточки лота: {e}")
 
 @dp.callback_query(F.data.startswith("lot:"))
 async def show_lot(call: types.CallbackQuery):
-    # Перезагружаем каталог из файла
-    global catalog
-    catalog = reload_catalog()
+    await reload_catalog()
     
-    lot_id = int(call.data.split(":")[1])
-    item = next((x for x in catalog if x["id"] == lot_id), None)
+    # lot:<id> или lot:<id>:<rid>:<позиция> при просмотре из выдачи
+    parts = call.data.split(":")
+    lot_id = int(parts[1])
+    item = catalog.get(lot_id)
     if not item:
         await call.answer("❌ Лот удалён", show_alert=True)
         return
 
-    # Находим индекс текущего лота для пагинации
-    current_page = next((i for i, x in enumerate(catalog) if x["id"] == lot_id), 0)
+    # Индекс текущего лота для пагинации
+    cursor = cursors.get(parts[2]) if len(parts) == 4 else None
+    if cursor is not None and lot_id in cursor.ids:
+        current_page, total = cursor.ids.index(lot_id), len(cursor.ids)
+    else:
+        cursor = None
+        current_page, total = catalog.position(lot_id), len(catalog)
 
-    # Красивое оформление детальной карточки
-    caption = (
-        f"━━━━━━━━━━━━━━━━━━━━\n"
-        f"*{item['title'].upper()}*\n"
-        f"━━━━━━━━━━━━━━━━━━━━\n\n"
-        f"📅 *Год/возраст:* {item['year']}\n"
-        f"⭐ *Состояние:* {item['condition']}\n"
-        f"📏 *Размер:* {item['size']}\n"
-        f"📍 *Город:* {item['city']}\n\n"
-        f"💰 *{item['price']} ₽*\n\n"
-    )
-    
-    if item.get('comment') and item['comment'] != '-':
-        caption += f"💬 *Описание:*\n{item['comment']}\n\n"
-    
-    caption += f"🆔 Лот №{item['id']}"
-    
     try:
         # Удаляем старое сообщение
         try:
@@ -783,14 +3738,15 @@ async def show_lot(call: types.CallbackQuery):
             pass
         
         # Отправляем медиа-группу с фото
-        media = [InputMediaPhoto(media=item["photos"][0], caption=caption, parse_mode="Markdown")]
-        for p in item["photos"][1:]:
-            media.append(InputMediaPhoto(media=p))
-        
-        msgs = await bot.send_media_group(chat_id=call.message.chat.id, media=media)
+        msgs = await bot.send_media_group(chat_id=call.message.chat.id, media=render_cache.detail(item))
         await msgs[-1].reply(
             "💡 Выберите действие:",
-            reply_markup=lot_inline_kb(lot_id, current_page=current_page)
+            reply_markup=lot_inline_kb(
+                lot_id,
+                current_page=current_page,
+                total=total,
+                cursor=cursor.rid if cursor else None,
+            )
         )
     except Exception as e:
         logger.exception(f"Ошибка показа лота: {e}")
@@ -800,20 +3756,36 @@ async def show_lot(call: types.CallbackQuery):
 
 @dp.callback_query(F.data.startswith("page:"))
 async def show_page(call: types.CallbackQuery):
-    """Обработка пагинации каталога"""
-    page = int(call.data.split(":")[1])
+    """Обработка пагинации каталога: page:<страница>[:<фото>]"""
+    parts = call.data.split(":")
+    page = int(parts[1])
+    photo = int(parts[2]) if len(parts) > 2 else 0
     
     if page < 0 or page >= len(catalog):
         await call.answer("❌ Страница не найдена", show_alert=True)
         return
     
-    try:
-        # Удаляем старое сообщение
-        await call.message.delete()
-    except:
-        pass
+    await show_catalog_page(call.message.chat.id, page, message=call.message, photo=photo)
+    await call.answer()
+
+@dp.callback_query(F.data.startswith("cur:"))
+async def show_cursor_page(call: types.CallbackQuery):
+    """Пагинация внутри выдачи фильтра или поиска: cur:<rid>:<страница>[:<фото>]"""
+    parts = call.data.split(":")
+    rid, page = parts[1], int(parts[2])
+    photo = int(parts[3]) if len(parts) > 3 else 0
+    cursor = cursors.get(rid)
+    
+    if cursor is None:
+        await call.answer("⌛ Выдача устарела, повторите поиск или фильтр", show_alert=True)
+        return
+    if not cursor.ids:
+        await call.answer("📭 Все лоты из этой выдачи уже проданы", show_alert=True)
+        return
+    # После удаления лотов выдача могла стать короче
+    page = min(max(page, 0), len(cursor.ids) - 1)
     
-    await show_catalog_page(call.message.chat.id, page)
+    await show_catalog_page(call.message.chat.id, page, cursor=cursor, message=call.message, photo=photo)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("catalog:"))
@@ -821,12 +3793,7 @@ async def back_to_catalog(call: types.CallbackQuery):
     """Возврат к каталогу"""
     page = int(call.data.split(":")[1])
     
-    try:
-        await call.message.delete()
-    except:
-        pass
-    
-    await show_catalog_page(call.message.chat.id, page)
+    await show_catalog_page(call.message.chat.id, page, message=call.message)
     await call.answer()
 
 @dp.callback_query(F.data == "filter_menu")
@@ -836,21 +3803,18 @@ async def filter_menu(call: types.CallbackQuery):
         [InlineKeyboardButton(text="📍 По городу", callback_data="filter:city")],
         [InlineKeyboardButton(text="💰 По цене", callback_data="filter:price")],
         [InlineKeyboardButton(text="📅 По году", callback_data="filter:year")],
+        [
+            InlineKeyboardButton(text="🔼 Сначала дешёвые", callback_data="sort:price_asc"),
+            InlineKeyboardButton(text="🔽 Сначала дорогие", callback_data="sort:price_desc"),
+        ],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="catalog:0")]
     ]
     
-    try:
-        await call.message.edit_text(
-            "🎯 *ФИЛЬТРЫ*\n\nВыберите параметр для фильтрации:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
-        )
-    except:
-        await call.message.answer(
-            "🎯 *ФИЛЬТРЫ*\n\nВыберите параметр для фильтрации:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
-        )
+    await edit_menu(
+        call.message,
+        "🎯 *ФИЛЬТРЫ*\n\nВыберите параметр для фильтрации:",
+        InlineKeyboardMarkup(inline_keyboard=keyboard),
+    )
     await call.answer()
 
 @dp.callback_query(F.data == "search_menu")
@@ -858,24 +3822,14 @@ async def search_menu(call: types.CallbackQuery, state: FSMContext):
     """Меню поиска"""
     await state.set_state(SearchState.waiting)
     
-    try:
-        await call.message.edit_text(
-            "🔍 *ПОИСК ПО КАТАЛОГУ*\n\n"
-            "Введите название или ключевое слово для поиска:",
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_search")]]
-            )
-        )
-    except:
-        await call.message.answer(
-            "🔍 *ПОИСК ПО КАТАЛОГУ*\n\n"
-            "Введите название или ключевое слово для поиска:",
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_search")]]
-            )
-        )
+    await edit_menu(
+        call.message,
+        "🔍 *ПОИСК ПО КАТАЛОГУ*\n\n"
+        "Введите название или ключевое слово для поиска:",
+        InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_search")]]
+        ),
+    )
     await call.answer()
 
 @dp.callback_query(F.data == "cancel_search")
@@ -896,22 +3850,16 @@ async def handle_search(m: types.Message, state: FSMContext):
         await m.answer("Поиск отменён.", reply_markup=main_kb)
         return
     
-    search_query = m.text.lower().strip()
+    search_query = (m.text or "").strip()
     
     if not search_query:
         await m.answer("❌ Введите поисковый запрос.", reply_markup=main_kb)
         await state.clear()
         return
     
-    # Поиск по названию, году, состоянию, городу
-    found = []
-    for i, item in enumerate(catalog):
-        if (search_query in item['title'].lower() or
-            search_query in str(item['year']).lower() or
-            search_query in item['condition'].lower() or
-            search_query in item['city'].lower() or
-            (item.get('comment') and search_query in item['comment'].lower())):
-            found.append(i)
+    # Поиск по названию, году, состоянию, городу и комментарию
+    await reload_catalog()
+    found = search_index.search(search_query)
     
     if not found:
         await m.answer(
@@ -922,46 +3870,32 @@ async def handle_search(m: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Показываем первый найденный лот
-    await show_catalog_page(m.chat.id, found[0])
+    # Навигация дальше листает только найденные лоты
+    await show_catalog_page(m.chat.id, 0, cursor=cursors.create(found))
     await m.answer(
         f"✅ Найдено лотов: {len(found)}\n"
-        f"Показан первый результат. Используйте навигацию для просмотра остальных.",
+        f"Показаны лучшие совпадения. Используйте навигацию для просмотра остальных.",
         reply_markup=main_kb
     )
     await state.clear()
 
-@dp.callback_query(F.data == "list_all")
+@dp.callback_query((F.data == "list_all") | F.data.startswith("ls:"))
 async def list_all_lots(call: types.CallbackQuery):
-    """Показать список всех лотов"""
+    """Список всех лотов по страницам: ls:<сортировка>[:<a|b>:<цена>:<id>]"""
+    await reload_catalog()
     if not catalog:
         await call.answer("📭 Лотов нет", show_alert=True)
         return
-    
-    # Создаем список лотов (максимум 50)
-    keyboard = []
-    for item in catalog[:50]:
-        keyboard.append([InlineKeyboardButton(
-            text=f"{item['title'][:35]}... | {item['price']}₽",
-            callback_data=f"lot:{item['id']}"
-        )])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 К каталогу", callback_data="catalog:0")])
-    
-    try:
-        await call.message.edit_text(
-            f"📋 *СПИСОК ВСЕХ ЛОТОВ* ({len(catalog)} шт)\n\n"
-            "Выберите лот для просмотра:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
-        )
-    except:
-        await call.message.answer(
-            f"📋 *СПИСОК ВСЕХ ЛОТОВ* ({len(catalog)} шт)\n\n"
-            "Выберите лот для просмотра:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
-        )
+
+    parts = call.data.split(":")
+    sort = parts[1] if len(parts) > 1 and parts[1] in LIST_SORTS else "new"
+    if len(parts) == 5:
+        direction, price, lot_id = parts[2], int(parts[3]) if parts[3] else None, int(parts[4])
+    else:
+        direction, price, lot_id = "a", None, None
+
+    text, keyboard = lot_lists.page(sort, direction, price, lot_id)
+    await edit_menu(call.message, text, keyboard)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("filter:"))
@@ -970,21 +3904,8 @@ async def handle_filter(call: types.CallbackQuery):
     filter_type = call.data.split(":")[1]
     
     if filter_type == "city":
-        # Получаем список уникальных городов
-        cities = sorted(set(item['city'] for item in catalog))
-        keyboard = []
-        for city in cities[:10]:  # Максимум 10 городов
-            keyboard.append([InlineKeyboardButton(
-                text=f"📍 {city}",
-                callback_data=f"filter_city:{city}"
-            )])
-        keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="filter_menu")])
-        
-        await call.message.edit_text(
-            "📍 *ФИЛЬТР ПО ГОРОДУ*\n\nВыберите город:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
-        )
+        await reload_catalog()
+        await edit_menu(call.message, *city_picker(0))
     elif filter_type == "price":
         keyboard = [
             [InlineKeyboardButton(text="💰 До 5000₽", callback_data="filter_price:0:5000")],
@@ -993,32 +3914,78 @@ async def handle_filter(call: types.CallbackQuery):
             [InlineKeyboardButton(text="💰 От 20000₽", callback_data="filter_price:20000:999999")],
             [InlineKeyboardButton(text="🔙 Назад", callback_data="filter_menu")]
         ]
-        await call.message.edit_text(
+        await edit_menu(
+            call.message,
             "💰 *ФИЛЬТР ПО ЦЕНЕ*\n\nВыберите диапазон:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
-            parse_mode="Markdown"
+            InlineKeyboardMarkup(inline_keyboard=keyboard),
         )
     elif filter_type == "year":
-        await call.answer(
-            "📅 Фильтр по году будет добавлен в следующем обновлении!",
-            show_alert=True
+        keyboard = [
+            [InlineKeyboardButton(text="📅 До 1950", callback_data="filter_year::1949")],
+            [InlineKeyboardButton(text="📅 1950-1969", callback_data="filter_year:1950:1969")],
+            [InlineKeyboardButton(text="📅 1970-1989", callback_data="filter_year:1970:1989")],
+            [InlineKeyboardButton(text="📅 1990-2009", callback_data="filter_year:1990:2009")],
+            [InlineKeyboardButton(text="📅 С 2010", callback_data="filter_year:2010:")],
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="filter_menu")]
+        ]
+        await edit_menu(
+            call.message,
+            "📅 *ФИЛЬТР ПО ГОДУ*\n\nВыберите период:",
+            InlineKeyboardMarkup(inline_keyboard=keyboard),
         )
     
     await call.answer()
 
-@dp.callback_query(F.data.startswith("filter_city:"))
+def city_picker(page: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Страница меню городов: кнопка несёт короткий id фасета, а не название"""
+    cities = city_facet.ordered()
+    pages = max(1, -(-len(cities) // CITY_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    keyboard = [
+        [InlineKeyboardButton(
+            text=f"📍 {city_facet.name(key)} ({city_facet.count(key)})",
+            callback_data=f"fc:{facet_id(key)}",
+        )]
+        for key in cities[page * CITY_PAGE_SIZE:(page + 1) * CITY_PAGE_SIZE]
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"fcity:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(text="Вперед ▶️", callback_data=f"fcity:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="filter_menu")])
+    text = "📍 *ФИЛЬТР ПО ГОРОДУ*\n\n"
+    if not cities:
+        text += "Лотов пока нет."
+    elif pages > 1:
+        text += f"Выберите город (стр. {page + 1}/{pages}):"
+    else:
+        text += "Выберите город:"
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@dp.callback_query(F.data.startswith("fcity:"))
+async def city_picker_page(call: types.CallbackQuery):
+    """Листание меню городов"""
+    await reload_catalog()
+    await edit_menu(call.message, *city_picker(int(call.data.split(":")[1])))
+    await call.answer()
+
+@dp.callback_query(F.data.startswith("fc:") | F.data.startswith("filter_city:"))
 async def apply_city_filter(call: types.CallbackQuery):
-    """Применение фильтра по городу"""
-    city = call.data.split(":", 1)[1]
-    filtered = [i for i, item in enumerate(catalog) if item['city'] == city]
+    """Применение фильтра по городу (filter_city:<название> — кнопки старых сообщений)"""
+    await reload_catalog()
+    prefix, value = call.data.split(":", 1)
+    key = city_facet.key_of(value) if prefix == "fc" else city_key(value)
+    filtered = city_facet.ids(key) if key else []
     
     if not filtered:
-        await call.answer(f"❌ Лотов в городе {city} не найдено", show_alert=True)
+        await call.answer("❌ Лотов в этом городе не найдено", show_alert=True)
         return
     
-    # Показываем первый отфильтрованный лот
-    await call.message.delete()
-    await show_catalog_page(call.message.chat.id, filtered[0])
+    # Показываем первый отфильтрованный лот, дальше листаем только выдачу
+    await show_catalog_page(call.message.chat.id, 0, cursor=cursors.create(filtered), message=call.message)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("filter_price:"))
@@ -1028,25 +3995,46 @@ async def apply_price_filter(call: types.CallbackQuery):
     min_price = int(min_price)
     max_price = int(max_price)
     
-    filtered = []
-    for i, item in enumerate(catalog):
-        try:
-            price = int(''.join(filter(str.isdigit, str(item['price']))))
-            if min_price <= price <= max_price:
-                filtered.append(i)
-        except:
-            continue
+    filtered = await catalog.find_ids(price_min=min_price, price_max=max_price)
     
     if not filtered:
         await call.answer("❌ Лотов в этом диапазоне цен не найдено", show_alert=True)
         return
     
-    # Показываем первый отфильтрованный лот
-    try:
-        await call.message.delete()
-    except:
-        pass
-    await show_catalog_page(call.message.chat.id, filtered[0])
+    await show_catalog_page(call.message.chat.id, 0, cursor=cursors.create(filtered), message=call.message)
+    await call.answer()
+
+@dp.callback_query(F.data.startswith("filter_year:"))
+async def apply_year_filter(call: types.CallbackQuery):
+    """Применение фильтра по году"""
+    _, min_year, max_year = call.data.split(":")
+    
+    filtered = await catalog.find_ids(
+        year_min=int(min_year) if min_year else None,
+        year_max=int(max_year) if max_year else None,
+    )
+    
+    if not filtered:
+        await call.answer("❌ Лотов этого периода не найдено", show_alert=True)
+        return
+    
+    await show_catalog_page(call.message.chat.id, 0, cursor=cursors.create(filtered), message=call.message)
+    await call.answer()
+
+@dp.callback_query(F.data.startswith("sort:"))
+async def apply_sort(call: types.CallbackQuery):
+    """Каталог, отсортированный по цене (лоты без цены — в конце)"""
+    order = call.data.split(":")[1]
+    await reload_catalog()
+    ordered = price_index.ordered(reverse=order == "price_desc")
+    priced = set(ordered)
+    ordered += [item.id for item in catalog if item.id not in priced]
+    
+    if not ordered:
+        await call.answer("📭 Лотов нет", show_alert=True)
+        return
+    
+    await show_catalog_page(call.message.chat.id, 0, cursor=cursors.create(ordered), message=call.message)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("sold:"))
@@ -1056,18 +4044,23 @@ async def mark_as_sold(call: types.CallbackQuery):
         await call.answer("🚫 Нет прав.", show_alert=True)
         return
     
-    # Перезагружаем каталог из файла
-    global catalog
-    catalog = reload_catalog()
-    
-    lot_id = int(call.data.split(":")[1])
+    parts = call.data.split(":")
+    lot_id = int(parts[1])
+    # Отпечаток лота на момент заявки покупателя (в старых кнопках его нет)
+    expected = parts[2] if len(parts) > 2 else None
     
     # Удаляем лот из каталога
-    before = len(catalog)
-    catalog = [l for l in catalog if l["id"] != lot_id]
-    save_catalog()
-    
-    if len(catalog) < before:
+    await reload_catalog()
+    try:
+        removed = catalog.remove(lot_id, event="sold", expected=expected)
+    except ConflictError:
+        await call.answer(
+            "⚠️ Лот изменился после заявки покупателя. Проверьте его и удалите через /del.",
+            show_alert=True,
+        )
+        return
+    if removed is not None:
+        save_catalog()
         try:
             await call.message.edit_text(
                 call.message.text + f"\n\n✅ *ЛОТ ПРОДАН И УДАЛЁН ИЗ КАТАЛОГА*",
@@ -1101,17 +4094,19 @@ async def back_main(call: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("buy:"))
 async def cb_buy(call: types.CallbackQuery, state: FSMContext):
     lot_id = int(call.data.split(":")[1])
-    item = next((x for x in catalog if x["id"] == lot_id), None)
+    item = catalog.get(lot_id)
     if not item:
         await call.answer("❌ Лот недоступен", show_alert=True)
         return
 
     await state.set_state(BuyAddress.waiting)
-    await state.update_data(buy_lot_id=lot_id)
+    # Отпечаток лота: если до отправки контактов он продан или изменён, заявка не уйдёт.
+    # Состояние формы переживает рестарт, поэтому сравниваем содержимое, а не счётчики процесса
+    await state.update_data(buy_lot_id=lot_id, buy_lot_fingerprint=item.fingerprint())
     await call.message.answer(
         f"🛒 *ПОДТВЕРЖДЕНИЕ ПОКУПКИ*\n\n"
-        f"Лот №{lot_id}: {item['title']}\n"
-        f"💰 {item['price']} ₽\n\n"
+        f"Лот №{lot_id}: {item.title}\n"
+        f"💰 {item.price} ₽\n\n"
         "📝 Напишите ваши контакты:\n"
         "• Телефон\n"
         "• Telegram\n"
@@ -1131,20 +4126,29 @@ async def buy_address(m: types.Message, state: FSMContext):
     
     data = await state.get_data()
     lot_id = data["buy_lot_id"]
-    item = next((x for x in catalog if x["id"] == lot_id), None)
+    await reload_catalog()
+    item = catalog.get(lot_id)
+    expected = data.get("buy_lot_fingerprint")
+    if item is None or (expected is not None and item.fingerprint() != expected):
+        await state.clear()
+        await m.answer(
+            "❌ Лот уже продан или изменился. Откройте его в каталоге заново.",
+            reply_markup=main_kb,
+        )
+        return
 
     # Клавиатура для админа с кнопкой удаления лота
     admin_kb = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Продано (удалить лот)", callback_data=f"sold:{lot_id}")],
+            [InlineKeyboardButton(text="✅ Продано (удалить лот)", callback_data=f"sold:{lot_id}:{item.fingerprint()}")],
         ]
     )
 
     await bot.send_message(
         ADMIN_ID,
         f"🛒 *НОВАЯ ЗАЯВКА НА ПОКУПКУ*\n\n"
-        f"🆔 Лот №{lot_id} ({item['title'] if item else 'UNKNOWN'})\n"
-        f"💰 {item['price'] if item else 'N/A'} ₽\n\n"
+        f"🆔 Лот №{lot_id} ({item.title if item else 'UNKNOWN'})\n"
+        f"💰 {item.price if item else 'N/A'} ₽\n\n"
         f"👤 @{m.from_user.username or 'без username'} (ID: {m.from_user.id})\n\n"
         f"📞 *Контакты*:\n{m.text}",
         parse_mode="Markdown",
@@ -1205,45 +4209,427 @@ async def support_message(m: types.Message, state: FSMContext):
     await state.clear()
 
 
+# ========================== Метрики и здоровье ===================
+metrics.collect(
+    "vintagebot_records", "Записей в хранилищах",
+    lambda: {(("store", "catalog"),): len(catalog), (("store", "pending"),): len(pending)},
+)
+metrics.collect("vintagebot_send_queue_depth", "Исходящих запросов в очереди", lambda: send_scheduler.queue_depth)
+metrics.collect(
+    "vintagebot_send_throttled_total", "Запросов, задержанных лимитами", lambda: send_scheduler.throttled, "counter",
+)
+metrics.collect(
+    "vintagebot_send_throttle_seconds_total", "Суммарная задержка лимитами",
+    lambda: send_scheduler.throttle_delay_total, "counter",
+)
+metrics.collect("vintagebot_send_dropped_total", "Запросов, потерянных после повторов", lambda: send_scheduler.dropped, "counter")
+metrics.collect(
+    "vintagebot_render_cache_total", "Обращения к кэшу карточек",
+    lambda: {(("result", "hit"),): render_cache.hits, (("result", "miss"),): render_cache.misses}, "counter",
+)
+metrics.collect("vintagebot_loop_lag_seconds", "Опоздание event loop", lambda: loop_lag.lag)
+
+
+async def check_storage() -> str | None:
+    """Текст проблемы с хранилищем или None, если всё в порядке"""
+    for store in (catalog, pending):
+        if not store.last_write_ok:
+            return f"{store.name}: последняя запись не удалась"
+    if db is not None:
+        try:
+            await asyncio.wait_for(db.run(lambda: db.conn.execute("SELECT 1").fetchone()), 2)
+        except Exception as e:
+            return f"sqlite: {e!r}"
+    elif not os.access(CATALOG_FILE.resolve().parent, os.W_OK):
+        return f"нет прав на запись в {CATALOG_FILE.resolve().parent}"
+    return None
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def health_view(request: web.Request) -> web.Response:
+    problem = warmup_error or await check_storage()
+    healthy = problem is None and loop_lag.lag <= HEALTH_MAX_LAG
+    if healthy:
+        # Пока данные грузятся, сервис жив и принимает обновления — они подождут
+        status = "ok" if data_ready.is_set() else "warming"
+    else:
+        status = "fail"
+    return web.json_response(
+        {
+            "status": status,
+            "loop_lag": round(loop_lag.lag, 4),
+            "storage": problem or "ok",
+            "catalog": len(catalog),
+            "pending": len(pending),
+        },
+        status=200 if healthy else 503,
+    )
+
 # ========================== Webhook ==============================
-async def on_startup(app: web.Application):
+def update_chat_id(update: dict) -> int | None:
+    """Чат (или пользователь), к которому относится обновление"""
+    for body in update.values():
+        if not isinstance(body, dict):
+            continue
+        chat = body.get("chat") or (body.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if body.get("from"):
+            return body["from"]["id"]
+    return None
+
+
+class UpdatePipeline:
+    """Отсев повторных доставок и очереди обновлений по чатам.
+
+    Telegram повторяет обновление, если ответ на webhook задержался: уже
+    виденные update_id (ограниченный LRU) отбрасываются. Обновления одного
+    чата обрабатываются строго по очереди, разные чаты — параллельно.
+    """
+
+    def __init__(self, seen_limit: int = UPDATE_SEEN_LIMIT, backlog_limit: int = CHAT_BACKLOG_LIMIT):
+        self.seen_limit = seen_limit
+        self.backlog_limit = backlog_limit
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self._queues: dict[int, deque] = {}
+        self._workers: set[asyncio.Task] = set()
+        self.duplicates = 0
+        self.dropped = 0
+
+    def is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            self.duplicates += 1
+            return True
+        self._seen[update_id] = None
+        while len(self._seen) > self.seen_limit:
+            self._seen.popitem(last=False)
+        return False
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    def submit(self, chat_id: int | None, coro) -> bool:
+        """Ставит обработку в очередь чата; False — если очередь переполнена"""
+        if chat_id is None:
+            self._spawn(self._run(coro))
+            return True
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._spawn(self._drain(chat_id, queue))
+        elif len(queue) >= self.backlog_limit:
+            coro.close()
+            self.dropped += 1
+            logger.warning(f"Очередь чата {chat_id} переполнена, обновление отброшено")
+            return False
+        queue.append(coro)
+        return True
+
+    @staticmethod
+    async def _run(coro):
+        try:
+            await coro
+        except Exception:
+            logger.exception("Ошибка обработки обновления")
+
+    async def _drain(self, chat_id: int, queue: deque):
+        try:
+            while queue:
+                await self._run(queue.popleft())
+        finally:
+            for coro in queue:
+                coro.close()
+            self._queues.pop(chat_id, None)
+
+    async def close(self, timeout: float = 10):
+        """Даёт очередям доработать при остановке"""
+        if self._workers:
+            await asyncio.wait(set(self._workers), timeout=timeout)
+
+
+class PipelineRequestHandler(SimpleRequestHandler):
+    """Webhook: сразу отвечает Telegram, обработку отдаёт в UpdatePipeline"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, pipeline: UpdatePipeline, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.pipeline = pipeline
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        update_id = update.get("update_id")
+        if update_id is not None and self.pipeline.is_duplicate(update_id):
+            logger.info(f"Повторная доставка обновления {update_id} пропущена")
+        else:
+            self.pipeline.submit(update_chat_id(update), self._background_feed_update(bot=bot, update=update))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        await self.pipeline.close()
+        await super().close()
+
+
+update_pipeline = UpdatePipeline()
+metrics.collect(
+    "vintagebot_updates_duplicate_total", "Повторные доставки, отброшенные по update_id",
+    lambda: update_pipeline.duplicates, "counter",
+)
+metrics.collect(
+    "vintagebot_updates_dropped_total", "Обновления, отброшенные из-за переполненной очереди чата",
+    lambda: update_pipeline.dropped, "counter",
+)
+metrics.collect("vintagebot_updates_backlog", "Обновлений в очередях чатов", lambda: update_pipeline.backlog)
+
+async def setup_webhook(ready=None):
+    """Ставит webhook, только если Telegram знает другой адрес.
+
+    ready — чего дождаться перед сообщением админу (по умолчанию загрузки данных).
+    """
     try:
-        # Проверяем и создаем JSON файлы при запуске
-        logger.info("Проверка JSON файлов при запуске...")
-        init_json_files()
-        
-        # Перезагружаем данные из файлов
-        global catalog, pending
-        catalog = reload_catalog()
-        pending = reload_pending()
-        logger.info(f"Загружено лотов: {len(catalog)}, заявок на модерацию: {len(pending)}")
-        
-        # Устанавливаем webhook
+        info = await bot.get_webhook_info()
+        if info.url == WEBHOOK_URL:
+            logger.info("Webhook уже установлен")
+            return
         await bot.set_webhook(WEBHOOK_URL)
-        await bot.send_message(ADMIN_ID, "🚀 БОТ ЗАПУЩЕН И ГОТОВ К РАБОТЕ!")
         logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+        # Сообщаем только о новом адресе (деплой), а не о каждом пробуждении
+        await (ready or data_ready.wait)()
+        await bot.send_message(ADMIN_ID, "🚀 БОТ ЗАПУЩЕН И ГОТОВ К РАБОТЕ!")
+    except Exception:
+        logger.exception("Ошибка установки webhook")
+
+async def close_data():
+    """Сбрасывает несохранённое и закрывает хранилища"""
+    loop_lag.stop()
+    if _warmup_task is not None and not _warmup_task.done():
+        _warmup_task.cancel()
+    try:
+        await catalog.close()
+        await pending.close()
+        if db is not None:
+            db.close()
+        await storage.close()
     except Exception:
-        logger.exception("Ошибка в on_startup")
+        logger.exception("Ошибка сохранения данных при остановке")
+
+async def on_startup(app: web.Application):
+    # Ничего не ждём: порт открывается сразу, данные и webhook — в фоне
+    loop_lag.start()
+    start_warmup()
+    app["webhook_task"] = asyncio.create_task(setup_webhook())
 
 async def on_shutdown(app: web.Application):
+    app["webhook_task"].cancel()
+    await close_data()
     try:
-        await bot.delete_webhook()
+        # Webhook не снимаем: после сна Render именно он будит сервис
         await bot.session.close()
         logger.info("Бот остановлен.")
     except Exception:
         logger.exception("Ошибка в on_shutdown")
 
+def add_service_routes(app: web.Application) -> web.Application:
+    async def index(request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+    app.router.add_get("/", index)
+    app.router.add_get("/health", health_view)
+    app.router.add_get("/metrics", metrics_view)
+    return app
+
 def create_app() -> web.Application:
     app = web.Application()
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
-    
-    async def index(request: web.Request) -> web.Response:
-        return web.Response(text="OK")
-    app.router.add_get("/", index)
-    
+    PipelineRequestHandler(dispatcher=dp, bot=bot, pipeline=update_pipeline).register(app, path=WEBHOOK_PATH)
+    return add_service_routes(app)
+
+# ========================== Polling ==============================
+async def run_polling():
+    """Long polling — без публичного адреса; /health и /metrics остаются на PORT"""
+    runner = web.AppRunner(add_service_routes(web.Application()))
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    loop_lag.start()
+    start_warmup()
+    try:
+        # getUpdates не работает, пока установлен webhook
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        await close_data()
+        await runner.cleanup()
+
+# ========================== Воркеры ==============================
+class WorkerPool:
+    """Ingress режима workers: раздаёт обновления N процессам по chat_id.
+
+    Обновления одного чата всегда уходят в один и тот же воркер и по
+    очереди, поэтому FSM чата, альбомы и блокировки не расходятся между
+    процессами. Все действия админа идут из его чата, то есть модерация
+    остаётся в одном процессе. Каталог, заявки, счётчики id и FSM лежат
+    в общей SQLite базе, изменения других воркеров подхватываются по
+    счётчикам изменений таблиц (table_versions).
+    """
+
+    def __init__(self, count: int, base_port: int):
+        self.count = max(1, count)
+        self.base_port = base_port
+        self.pipeline = UpdatePipeline()
+        self.procs: list[subprocess.Popen] = []
+        self.http: ClientSession | None = None
+
+    def url(self, index: int, path: str = "/update") -> str:
+        return f"http://127.0.0.1:{self.base_port + index}{path}"
+
+    async def start(self, app: web.Application):
+        # Общий лимит отправки делится между воркерами
+        env = {**os.environ, "RUN_MODE": "worker", "SEND_GLOBAL_RATE": str(SEND_GLOBAL_RATE / self.count)}
+        for index in range(self.count):
+            self.procs.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                env={**env, "WORKER_INDEX": str(index), "WORKER_PORT": str(self.base_port + index)},
+            ))
+        self.http = ClientSession(timeout=ClientTimeout(total=10))
+        logger.info(f"Запущено воркеров: {self.count}, порты {self.base_port}..{self.base_port + self.count - 1}")
+
+    async def stop(self, app: web.Application):
+        await self.pipeline.close()
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                await asyncio.to_thread(proc.wait, 15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.http is not None:
+            await self.http.close()
+
+    async def forward(self, index: int, update: dict):
+        # Воркер может ещё подниматься — несколько попыток с нарастающей паузой
+        for attempt in range(8):
+            try:
+                async with self.http.post(self.url(index), json=update) as resp:
+                    resp.raise_for_status()
+                    return
+            except (ClientError, OSError, asyncio.TimeoutError) as e:
+                error = e
+                await asyncio.sleep(min(0.2 * 2 ** attempt, 3))
+        logger.error(f"Обновление {update.get('update_id')} не передано воркеру {index}: {error!r}")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        update = await request.json()
+        update_id = update.get("update_id")
+        if update_id is not None and self.pipeline.is_duplicate(update_id):
+            logger.info(f"Повторная доставка обновления {update_id} пропущена")
+        else:
+            chat_id = update_chat_id(update)
+            index = 0 if chat_id is None else chat_id % self.count
+            self.pipeline.submit(chat_id, self.forward(index, update))
+        return web.json_response({})
+
+    async def worker_status(self, index: int) -> str:
+        if self.procs[index].poll() is not None:
+            return "dead"
+        try:
+            async with self.http.get(self.url(index, "/health"), timeout=ClientTimeout(total=2)) as resp:
+                return (await resp.json()).get("status", "fail")
+        except (ClientError, OSError, asyncio.TimeoutError, ValueError):
+            return "starting"
+
+    async def statuses(self) -> list[str]:
+        return await asyncio.gather(*(self.worker_status(i) for i in range(self.count)))
+
+    async def wait_ready(self):
+        """Ждёт, пока все воркеры загрузят данные"""
+        while not all(status == "ok" for status in await self.statuses()):
+            await asyncio.sleep(1)
+
+    async def health(self, request: web.Request) -> web.Response:
+        statuses = await self.statuses()
+        # Как и в одном процессе: пока воркеры поднимаются и грузят данные,
+        # сервис жив (warming), обновления ждут в очередях
+        healthy = all(status in ("ok", "warming", "starting") for status in statuses)
+        if not healthy:
+            status = "fail"
+        else:
+            status = "ok" if all(s == "ok" for s in statuses) else "warming"
+        return web.json_response({"status": status, "workers": statuses}, status=200 if healthy else 503)
+
+def create_ingress_app() -> web.Application:
+    pool = WorkerPool(WORKERS, WORKER_BASE_PORT)
+    app = web.Application()
+
+    async def start_webhook(app: web.Application):
+        # Данные грузят воркеры, не ingress: ждём их, а не data_ready
+        app["webhook_task"] = asyncio.create_task(setup_webhook(ready=pool.wait_ready))
+
+    async def stop_webhook(app: web.Application):
+        app["webhook_task"].cancel()
+        await bot.session.close()
+
+    app.on_startup.append(pool.start)
+    app.on_startup.append(start_webhook)
+    app.on_shutdown.append(pool.stop)
+    app.on_shutdown.append(stop_webhook)
+    app.router.add_post(WEBHOOK_PATH, pool.handle)
+    app.router.add_get("/health", pool.health)
     return app
 
+async def watch_parent(app: web.Application):
+    """Воркер завершается, если ingress-процесс умер"""
+    parent = os.getppid()
+
+    async def watch():
+        while os.getppid() == parent:
+            await asyncio.sleep(5)
+        logger.warning("Ingress-процесс завершился, останавливаю воркер")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    app["parent_watch"] = asyncio.create_task(watch())
+
+def create_worker_app() -> web.Application:
+    app = web.Application()
+
+    async def start(app: web.Application):
+        loop_lag.start()
+        start_warmup()
+
+    async def stop(app: web.Application):
+        app["parent_watch"].cancel()
+        await close_data()
+
+    app.on_startup.append(start)
+    app.on_startup.append(watch_parent)
+    app.on_shutdown.append(stop)
+    PipelineRequestHandler(dispatcher=dp, bot=bot, pipeline=update_pipeline).register(app, path="/update")
+    return add_service_routes(app)
+
 if __name__ == "__main__":
-    web.run_app(create_app(), host="0.0.0.0", port=PORT)
+    if sys.argv[1:2] == ["import-json"]:
+        # Разовый перенос данных: python main.py import-json
+        database = db or SqliteDatabase(DB_FILE)
+        lots_count, pending_count = import_json_to_sqlite(database, force="--force" in sys.argv)
+        print(f"Импортировано лотов: {lots_count}, заявок: {pending_count} -> {DB_FILE}")
+        database.close()
+        sys.exit(0)
+    if RUN_MODE == "polling":
+        asyncio.run(run_polling())
+    elif RUN_MODE == "workers":
+        if STORAGE_BACKEND != "sqlite" or FSM_STORAGE != "sqlite":
+            sys.exit("RUN_MODE=workers требует STORAGE_BACKEND=sqlite и FSM_STORAGE=sqlite (общее хранилище)")
+        web.run_app(create_ingress_app(), host="0.0.0.0", port=PORT)
+    elif RUN_MODE == "worker":
+        # Внутренний режим: процесс, запущенный ingress'ом
+        web.run_app(create_worker_app(), host="127.0.0.1", port=int(os.environ["WORKER_PORT"]))
+    else:
+        web.run_app(create_app(), host="0.0.0.0", port=PORT)
@@ -0,0 +1,57 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def make_lot(lot_id: int, **fields) -> main.Lot:
+    """Лот со всеми полями, как после модерации"""
+    values = {
+        "photos": ["photo"], "title": f"Лот {lot_id}", "year": "1990", "condition": "хорошее",
+        "size": "M", "city": "Москва", "price": "1000", "comment": "-", "owner_id": 1,
+    }
+    values.update(fields)
+    return main.Lot(id=lot_id, **values)
+
+
+def make_pending(pending_id: int, **fields) -> main.PendingItem:
+    values = {
+        "photos": ["photo"], "title": f"Заявка {pending_id}", "year": "1990", "condition": "хорошее",
+        "size": "M", "city": "Москва", "price": "1000", "comment": "-", "owner_id": 1,
+        "owner_username": "seller",
+    }
+    values.update(fields)
+    return main.PendingItem(pending_id=pending_id, **values)
+
+
+@pytest.fixture
+def fast_saves(monkeypatch):
+    monkeypatch.setattr(main, "SAVE_DELAY", 0.01)
+    monkeypatch.setattr(main, "SAVE_RETRY_MAX", 0.05)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def open_store(request, tmp_path):
+    """Фабрика хранилищ одного бэкенда: каждый вызов — отдельное подключение (как воркер)"""
+    dbs = []
+
+    def open_store(model=main.Lot):
+        table, columns = ("lots", main.LOT_COLUMNS) if model is main.Lot else ("pending", main.PENDING_COLUMNS)
+        if request.param == "json":
+            backend = main.JournalBackend(tmp_path / f"{table}.json", model)
+        else:
+            db = main.SqliteDatabase(tmp_path / "vintage.db")
+            dbs.append(db)
+            backend = main.SqliteBackend(db, table, model, columns)
+        return main.RecordStore(backend, model, name=table)
+
+    open_store.kind = request.param
+    yield open_store
+    for db in dbs:
+        db.close()
@@ -0,0 +1,80 @@
+import json
+
+import main
+from conftest import make_lot
+
+
+def write(backend, items: dict, changed=(), removed=(), event="approved") -> bool:
+    return backend.write_sync(
+        list(items.values()),
+        {lot_id: items[lot_id] for lot_id in changed},
+        set(removed),
+        dict.fromkeys([*changed, *removed], event),
+    )
+
+
+def test_replay_applies_journal_over_snapshot(tmp_path):
+    path = tmp_path / "catalog.json"
+    backend = main.JournalBackend(path, main.Lot)
+    backend.load()
+    items = {lot_id: make_lot(lot_id) for lot_id in (1, 2, 3)}
+    assert write(backend, items, changed=(1, 2, 3))
+    items[2].price = "5000"
+    del items[3]
+    assert write(backend, items, changed=(2,), removed=(3,), event="sold")
+
+    loaded = main.JournalBackend(path, main.Lot).load()
+    assert {lot.id: lot.price for lot in loaded} == {1: "1000", 2: "5000"}
+
+
+def test_torn_tail_is_cut_and_set_aside(tmp_path):
+    path = tmp_path / "catalog.json"
+    backend = main.JournalBackend(path, main.Lot)
+    backend.load()
+    items = {1: make_lot(1)}
+    assert write(backend, items, changed=(1,))
+    backend._close()
+    good_size = backend.journal.stat().st_size
+    with open(backend.journal, "ab") as f:
+        f.write(b'{"seq": 2, "ops": [{"put"')
+
+    reopened = main.JournalBackend(path, main.Lot)
+    assert [lot.id for lot in reopened.load()] == [1]
+    assert backend.journal.stat().st_size == good_size
+    assert list(tmp_path.glob("catalog.journal.jsonl.corrupt-*"))
+    # Следующая запись продолжает журнал с целой строки
+    items[2] = make_lot(2)
+    assert write(reopened, items, changed=(2,))
+    assert sorted(lot.id for lot in main.JournalBackend(path, main.Lot).load()) == [1, 2]
+
+
+def test_compaction_keeps_state_and_empties_journal(tmp_path):
+    path = tmp_path / "catalog.json"
+    backend = main.JournalBackend(path, main.Lot, compact_every=3)
+    backend.load()
+    items = {}
+    for lot_id in (1, 2, 3):
+        items[lot_id] = make_lot(lot_id)
+        assert write(backend, items, changed=(lot_id,))
+    assert backend.needs_compaction()
+    assert backend.compact(list(items.values()))
+
+    assert backend.journal.read_bytes() == b""
+    assert json.loads(path.read_text(encoding="utf-8"))["seq"] == 3
+    assert sorted(lot.id for lot in main.JournalBackend(path, main.Lot).load()) == [1, 2, 3]
+
+
+def test_entries_already_in_snapshot_are_skipped(tmp_path):
+    """Сбой между записью снимка и очисткой журнала: старые записи не применяются повторно"""
+    path = tmp_path / "catalog.json"
+    backend = main.JournalBackend(path, main.Lot)
+    backend.load()
+    items = {1: make_lot(1)}
+    assert write(backend, items, changed=(1,))
+    del items[1]
+    assert write(backend, items, removed=(1,), event="sold")
+    items[1] = make_lot(1, title="Снова в продаже")
+    assert main.save_records(path, list(items.values()), backend.seq)
+
+    loaded = main.JournalBackend(path, main.Lot).load()
+    assert [lot.title for lot in loaded] == ["Снова в продаже"]
@@ -0,0 +1,85 @@
+import asyncio
+
+import main
+
+
+def test_repeated_update_ids_are_dropped():
+    pipeline = main.UpdatePipeline(seen_limit=3)
+    assert [pipeline.is_duplicate(update_id) for update_id in (1, 2, 1, 3)] == [False, False, True, False]
+    assert pipeline.duplicates == 1
+    # Старые id вытесняются из ограниченного LRU
+    pipeline.is_duplicate(4)
+    pipeline.is_duplicate(5)
+    assert pipeline.is_duplicate(2) is False
+
+
+def test_chat_updates_run_in_order_and_chats_in_parallel():
+    async def scenario():
+        pipeline = main.UpdatePipeline()
+        log = []
+
+        async def handle(chat_id, n, delay):
+            log.append(("start", chat_id, n))
+            await asyncio.sleep(delay)
+            log.append(("end", chat_id, n))
+
+        pipeline.submit(1, handle(1, 1, 0.05))
+        pipeline.submit(1, handle(1, 2, 0))
+        pipeline.submit(2, handle(2, 1, 0))
+        await pipeline.close()
+        return log
+
+    log = asyncio.run(scenario())
+    chat1 = [entry for entry in log if entry[1] == 1]
+    assert chat1 == [("start", 1, 1), ("end", 1, 1), ("start", 1, 2), ("end", 1, 2)]
+    # Второй чат не ждёт медленное обновление первого
+    assert log.index(("end", 2, 1)) < log.index(("end", 1, 1))
+
+
+def test_overflowing_chat_backlog_is_dropped():
+    async def scenario():
+        pipeline = main.UpdatePipeline(backlog_limit=2)
+        done = []
+
+        async def handle(n):
+            await asyncio.sleep(0)
+            done.append(n)
+
+        accepted = [pipeline.submit(1, handle(n)) for n in range(4)]
+        await pipeline.close()
+        return accepted, done, pipeline.dropped
+
+    accepted, done, dropped = asyncio.run(scenario())
+    assert accepted == [True, True, False, False]
+    assert done == [0, 1]
+    assert dropped == 2
+
+
+def test_edits_do_not_wait_for_chat_bucket():
+    """Правки карточек в чате админа не упираются в лимит сообщений чата"""
+    from aiogram.methods import EditMessageText, SendMessage
+
+    async def scenario():
+        scheduler = main.SendScheduler()
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.__api_method__)
+
+        start = asyncio.get_running_loop().time()
+        for n in range(3):
+            await scheduler(make_request, None, SendMessage(chat_id=1, text=str(n)))
+        # Ведро чата пусто: ещё одно сообщение ждало бы секунду, а правки — нет
+        for n in range(10):
+            await scheduler(make_request, None, EditMessageText(chat_id=1, message_id=n, text="x"))
+        elapsed = asyncio.get_running_loop().time() - start
+        # Пауза после 429 держит и правки
+        scheduler.pause(1, 0.1)
+        await scheduler(make_request, None, EditMessageText(chat_id=1, message_id=1, text="y"))
+        paused = asyncio.get_running_loop().time() - start - elapsed
+        return len(sent), elapsed, paused
+
+    count, elapsed, paused = asyncio.run(scenario())
+    assert count == 14
+    assert elapsed < 0.5
+    assert paused >= 0.09
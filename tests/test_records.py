@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import main
+from conftest import make_pending
+
+
+def raw_pending(pending_id, title: str) -> dict:
+    return make_pending(1, title=title).to_dict() | {"pending_id": pending_id}
+
+
+def test_decode_separates_bad_and_repeated_records():
+    raws = [raw_pending(1, "A"), raw_pending(1, "B"), {"pending_id": 2, "title": ""}, "мусор"]
+    records, bad = main.decode_records(main.PendingItem, raws)
+    assert [record.title for record in records] == ["A"]
+    assert len(bad) == 3
+
+
+def test_v1_list_is_migrated_with_numeric_fields(tmp_path):
+    path = tmp_path / "pending.json"
+    raw = raw_pending(1, "A")
+    del raw["price_value"], raw["year_value"]
+    path.write_text(json.dumps([raw]), encoding="utf-8")
+
+    records, seq = main.load_records(path, main.PendingItem)
+    assert (records[0].price_value, records[0].year_value, seq) == (1000, 1990, 0)
+    saved = json.loads(path.read_text(encoding="utf-8"))
+    assert saved["format"] == main.RECORDS_FORMAT
+
+
+def test_v1_repeated_ids_get_fresh_ids(tmp_path):
+    """Старый бот выдавал одинаковые pending_id — вторая заявка не уходит в карантин"""
+    path = tmp_path / "pending.json"
+    path.write_text(json.dumps([raw_pending(1, "A"), raw_pending(2, "B"), raw_pending(2, "C")]), encoding="utf-8")
+    sequences = main.JsonSequences(tmp_path / "sequences.json")
+
+    backend = main.JournalBackend(path, main.PendingItem, fresh_ids=lambda count, floor: main.reserve_ids(
+        sequences, "pending", count, floor,
+    ))
+    records = backend.load()
+    assert sorted((record.pending_id, record.title) for record in records) == [(1, "A"), (2, "B"), (3, "C")]
+    assert not (tmp_path / "pending.json.quarantine.jsonl").exists()
+    # Счётчик сдвинут за выданный id
+    assert sequences.read_sequence("pending") >= 3
+    # Повторная загрузка уже мигрированного файла ничего не меняет
+    assert len(main.JournalBackend(path, main.PendingItem).load()) == 3
+
+
+def test_bad_records_go_to_quarantine(tmp_path):
+    path = tmp_path / "pending.json"
+    main.save_json(path, {"format": main.RECORDS_FORMAT, "seq": 0, "records": [raw_pending(1, "A"), {"pending_id": 2}]})
+
+    records, _ = main.load_records(path, main.PendingItem)
+    assert [record.pending_id for record in records] == [1]
+    quarantined = (tmp_path / "pending.json.quarantine.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(quarantined[0])["record"]["pending_id"] == 2
+
+
+def test_newer_format_is_left_untouched(tmp_path):
+    path = tmp_path / "pending.json"
+    main.save_json(path, {"format": main.RECORDS_FORMAT + 1, "records": []})
+    before = path.read_bytes()
+    with pytest.raises(RuntimeError):
+        main.load_records(path, main.PendingItem)
+    assert path.read_bytes() == before
+
+
+def test_sqlite_migrations_reach_latest_version(tmp_path):
+    db = main.SqliteDatabase(tmp_path / "vintage.db")
+    try:
+        db.open()
+        version = db.call(lambda: db.conn.execute("PRAGMA user_version").fetchone()[0])
+        assert version == len(main.SqliteDatabase.MIGRATIONS)
+        assert db.table_version("lots") == 0
+    finally:
+        db.close()
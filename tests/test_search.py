@@ -0,0 +1,62 @@
+import asyncio
+
+import main
+from conftest import make_lot
+
+
+def test_title_match_ranks_above_comment_and_infix_matches():
+    index = main.SearchIndex()
+    index.rebuild([
+        make_lot(1, title="Куртка", comment="к ней подойдут ботинки"),
+        make_lot(2, title="Ботинки кожаные"),
+        make_lot(3, title="Полуботинки"),
+        make_lot(4, title="Шляпа"),
+    ])
+    # Точное слово в названии, затем вхождение в название, затем комментарий
+    assert index.search("ботинки") == [2, 3, 1]
+    assert index.search("ботин") == [2, 3, 1]
+    # Середина слова: «тинки» находит и «ботинки», и «полуботинки»
+    assert sorted(index.search("тинки")) == [1, 2, 3]
+    # Все слова запроса обязательны
+    assert index.search("ботинки кожаные") == [2]
+    index.remove(make_lot(2))
+    assert index.search("кожаные") == []
+
+
+def page_lots(page) -> tuple[list[int], dict[str, tuple]]:
+    """id лотов на странице и курсоры кнопок «Назад»/«Вперед»"""
+    _, keyboard = page
+    lots, cursors = [], {}
+    for row in keyboard.inline_keyboard:
+        for button in row:
+            data = button.callback_data
+            if data.startswith("lot:"):
+                lots.append(int(data.split(":")[1]))
+            elif data.count(":") == 4:
+                _, sort, direction, price, lot_id = data.split(":")
+                cursors[direction] = (sort, direction, int(price) if price else None, int(lot_id))
+    return lots, cursors
+
+
+def test_keyset_pages_survive_concurrent_add_and_remove(open_store):
+    async def scenario():
+        store = open_store()
+        await store.load()
+        for lot_id in range(1, 26):
+            store.add(make_lot(lot_id, price=str(lot_id * 100)))
+        lists = main.LotLists(store, page_size=10)
+
+        first, cursors = page_lots(lists.page("pa", "a", None, None))
+        assert first == list(range(1, 11))
+        # Пока пользователь смотрит первую страницу, лоты продают и добавляют
+        store.remove(10)
+        store.remove(3)
+        store.add(make_lot(26, price="50"))
+        second, cursors = page_lots(lists.page(*cursors["a"]))
+        # Листание продолжается после показанного (уже удалённого) граничного лота
+        assert second == list(range(11, 21))
+        # Назад — к началу списка; первая страница снова полная
+        back, _ = page_lots(lists.page(*cursors["b"]))
+        assert back == [26, 1, 2, 4, 5, 6, 7, 8, 9, 11]
+
+    asyncio.run(scenario())
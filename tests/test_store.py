@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+import main
+from conftest import make_lot, make_pending
+
+
+def count_reloads(store) -> list:
+    reloads = []
+    set_items = store._set_items
+    store._set_items = lambda items: (reloads.append(len(items)), set_items(items))
+    return reloads
+
+
+def test_own_writes_do_not_reload(open_store, fast_saves):
+    async def scenario():
+        store = open_store()
+        await store.load()
+        reloads = count_reloads(store)
+        for lot_id in range(1, 51):
+            store.add(make_lot(lot_id), event="approved")
+            store.save()
+            flush = asyncio.create_task(store.flush())
+            await asyncio.sleep(0)
+            # Запись идёт в потоке: её изменение подписи — не внешняя правка
+            assert await store.refresh() is False
+            await flush
+            assert await store.refresh() is False
+        return reloads
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_failed_write_is_retried(open_store, fast_saves):
+    async def scenario():
+        store = open_store()
+        await store.load()
+        write = store.backend.write_sync
+        failures = [2]
+
+        def flaky(*args):
+            if failures[0]:
+                failures[0] -= 1
+                return False
+            return write(*args)
+
+        store.backend.write_sync = flaky
+        store.add(make_lot(1))
+        store.save()
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if store.last_write_ok and not store._dirty and not store._flush_lock.locked():
+                break
+        assert store.last_write_ok and not store._dirty
+        reader = open_store()
+        await reader.load()
+        return [lot.id for lot in reader]
+
+    assert asyncio.run(scenario()) == [1]
+
+
+def test_forced_refresh_keeps_unsaved_changes(open_store, fast_saves):
+    async def scenario():
+        store = open_store()
+        await store.load()
+        store.add(make_lot(1))
+        store.save()
+        assert await store.refresh(force=True) is False
+        assert store.get(1) is not None
+        await store.flush()
+        assert await store.refresh(force=True) is True
+        return store.get(1)
+
+    assert asyncio.run(scenario()) is not None
+
+
+def test_external_change_is_loaded(open_store, fast_saves):
+    async def scenario():
+        store, other = open_store(), open_store()
+        await store.load()
+        await other.load()
+        other.add(make_lot(7))
+        other.save()
+        await other.flush()
+        assert await store.refresh() is True
+        return [lot.id for lot in store]
+
+    assert asyncio.run(scenario()) == [7]
+
+
+def test_other_tables_do_not_reload_catalog(open_store, fast_saves):
+    if open_store.kind != "sqlite":
+        pytest.skip("общая база только у SQLite")
+
+    async def scenario():
+        catalog, pending = open_store(main.Lot), open_store(main.PendingItem)
+        await catalog.load()
+        await pending.load()
+        pending.add(make_pending(1), event="submitted")
+        pending.save()
+        await pending.flush()
+        await catalog.backend.db.run(catalog.backend.db.reserve_sequence, "lots", 10, 0)
+        return await catalog.refresh()
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_concurrent_commit_before_own_write_is_not_lost(open_store, fast_saves):
+    """Два воркера: коммит соседа перед нашей записью не прячется за нашей подписью"""
+    if open_store.kind != "sqlite":
+        pytest.skip("несколько процессов пишут только в SQLite")
+
+    async def scenario():
+        worker_a, worker_b = open_store(), open_store()
+        await worker_a.load()
+        await worker_b.load()
+        for lot_id in (1, 2):
+            worker_b.add(make_lot(lot_id))
+        worker_b.save()
+        await worker_b.flush()
+        worker_a.add(make_lot(100))
+        worker_a.save()
+        await worker_a.flush()
+        assert await worker_a.refresh() is True
+        return sorted(lot.id for lot in worker_a)
+
+    assert asyncio.run(scenario()) == [1, 2, 100]
+
+
+def test_remove_rejects_changed_record(open_store, fast_saves):
+    """Кнопка из старого сообщения не удаляет лот, изменённый после её отправки"""
+    async def scenario():
+        store = open_store()
+        await store.load()
+        store.add(make_lot(1))
+        seen = store.get(1).fingerprint()
+        store.put(make_lot(1, price="900"))
+        with pytest.raises(main.ConflictError):
+            store.remove(1, event="sold", expected=seen)
+        assert store.get(1) is not None
+        return store.remove(1, event="sold", expected=store.get(1).fingerprint())
+
+    assert asyncio.run(scenario()).price == "900"